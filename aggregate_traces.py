@@ -0,0 +1,56 @@
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+
+import numpy as np
+import tabulate
+
+from webvoyager.tracing import TRACE_FNAME
+
+
+def load_durations(dirname):
+    # span name -> list of durations in seconds, across all `trace.json` under `dirname`
+    durations = defaultdict(list)
+    n_traces = 0
+    for fname in glob.glob(os.path.join(dirname, '**', TRACE_FNAME), recursive=True):
+        try:
+            with open(fname) as f:
+                events = json.load(f)['traceEvents']
+        except (json.JSONDecodeError, KeyError):  # <- session killed while writing
+            continue
+        n_traces += 1
+        for e in events:
+            if e.get('ph') == 'X':
+                durations[e['name']].append(e['dur'] / 1e6)
+    return durations, n_traces
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir", help="e.g. the out_dirname of evaluate_all.py")
+    parser.add_argument("--sort", default="total", choices=["name", "total", "p50", "p95"])
+    args = parser.parse_args()
+
+    durations, n_traces = load_durations(args.dir)
+    print("Aggregated {:d} traces".format(n_traces))
+    if n_traces == 0:
+        return
+
+    total_session = sum(durations.get('session', [])) or 1.
+    table = []
+    for name, d in durations.items():
+        d = np.array(d)
+        table.append([
+            name, len(d), d.sum(), d.sum() / total_session * 100, np.mean(d), np.percentile(d, 50),
+            np.percentile(d, 95), d.max(),
+        ])
+    key = {'name': 0, 'total': 2, 'p50': 5, 'p95': 6}[args.sort]
+    table.sort(key=lambda x: x[key], reverse=args.sort != 'name')
+    print(tabulate.tabulate(table, headers=['Span', '#', 'Total (s)', '% of session', 'Mean (s)', 'p50 (s)',
+                                            'p95 (s)', 'Max (s)'], floatfmt='.3f'))
+
+
+if __name__ == "__main__":
+    main()
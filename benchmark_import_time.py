@@ -0,0 +1,92 @@
+import argparse
+import importlib
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import tabulate
+
+# Startup cost of the entry points: import time of each module (python -X importtime, in a fresh interpreter) and time
+# until a pool of workers is ready. With the fork start method workers inherit the imports of the parent; with spawn /
+# forkserver each worker imports the entry point again.
+
+ENTRY_POINTS = ['infer_multiturn_textual', 'infer_multiturn_visual', 'infer_acecoder_textual', 'infer_acecoder_visual',
+                'evaluate_all', 'usability', 'results_db', 'metric_stats']
+D = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_time(entry):
+    # (wall time of the interpreter, cumulative import time of `entry`, top-level packages by cumulative import time)
+    t0 = time.perf_counter()
+    ret = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {entry}'], cwd=D,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    wall = time.perf_counter() - t0
+    packages = {}
+    for line in ret.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:  # <- `entry` itself and its direct imports
+            packages[name.strip()] = int(cumulative) / 1e6
+    return wall, packages.pop(entry), sorted(packages.items(), key=lambda x: -x[1])
+
+
+def init_worker(entry, barrier):
+    importlib.import_module(entry)
+    barrier.wait()  # <- the pool is ready when all workers are
+
+
+def probe_worker_startup(entry, start_method, num_workers):
+    importlib.import_module(entry)
+    ctx = multiprocessing.get_context(start_method)
+    barrier = ctx.Barrier(num_workers)
+    t0 = time.perf_counter()
+    with ctx.Pool(num_workers, initializer=init_worker, initargs=(entry, barrier)) as pool:
+        pool.apply(os.getpid)
+        print(time.perf_counter() - t0)
+
+
+def worker_startup(entry, start_method, num_workers):
+    ret = subprocess.run([sys.executable, os.path.abspath(__file__), '--probe', entry, start_method, str(num_workers)],
+                         cwd=D, capture_output=True, text=True, check=True)
+    return float(ret.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entry", default=ENTRY_POINTS, nargs="+", choices=ENTRY_POINTS)
+    parser.add_argument("--repeat", default=5, type=int, help="runs per measure, the median is reported")
+    parser.add_argument("--num_workers", default=8, type=int)
+    parser.add_argument("--start_methods", default=['fork', 'spawn'], nargs="+",
+                        choices=multiprocessing.get_all_start_methods())
+    parser.add_argument("--top", default=3, type=int, help="heaviest direct imports to show")
+    parser.add_argument("--probe", default=None, nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.probe is not None:
+        entry, start_method, num_workers = args.probe
+        probe_worker_startup(entry, start_method, int(num_workers))
+        return
+
+    table = []
+    for entry in args.entry:
+        runs = [import_time(entry) for _ in range(args.repeat)]
+        line = [entry, statistics.median(r[0] for r in runs), statistics.median(r[1] for r in runs)]
+        for start_method in args.start_methods:
+            line.append(statistics.median(worker_startup(entry, start_method, args.num_workers)
+                                          for _ in range(args.repeat)))
+        line.append(', '.join('{} {:.2f}'.format(name, t) for name, t in runs[-1][2][:args.top]))
+        table.append(line)
+        print(tabulate.tabulate(table[-1:], floatfmt='.3f'), flush=True)
+
+    print(tabulate.tabulate(table, headers=['Entry point', 'Interpreter (s)', 'Import (s)'] + [
+        f'{args.num_workers} workers, {m} (s)' for m in args.start_methods
+    ] + ['Heaviest imports (s)'], floatfmt='.3f'))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import urllib.request
+
+import tabulate
+
+# End-to-end throughput benchmark of the entry points against the local mock server (mock_openai_server.py), to see
+# how they scale with --num_workers and where orchestration, not the LLM, becomes the bottleneck.
+
+ENTRY_POINTS = ['infer_multiturn_textual', 'infer_multiturn_visual', 'infer_acecoder_textual', 'infer_acecoder_visual',
+                'evaluate_all', 'usability']
+
+
+def start_server(args):
+    cmd = [sys.executable, 'mock_openai_server.py', '--port', str(args.port), '--latency', str(args.latency),
+           '--latency_sigma', str(args.latency_sigma), '--tokens_per_second', str(args.tokens_per_second),
+           '--error_rate', str(args.error_rate), '--overlength_rate', str(args.overlength_rate)]
+    server = subprocess.Popen(cmd, stdout=subprocess.DEVNULL)
+    for _ in range(50):
+        try:
+            get_stats(args)
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Mock server did not start")
+
+
+def get_stats(args):
+    with urllib.request.urlopen('http://localhost:{}/v1/stats'.format(args.port)) as f:
+        return json.load(f)
+
+
+def prepare(entry, num_workers, args):
+    # returns the command to run and its output dir; evaluation entry points run on a fresh copy of `--eval_dir`
+    out_dir = os.path.join(args.out_dir, f'{entry}.n{num_workers}')
+    shutil.rmtree(out_dir, ignore_errors=True)
+    common = ['--local_openai_port', str(args.port), '--openai_model', 'mock', '--num_workers', str(num_workers)]
+    if entry.startswith('infer_'):
+        return [sys.executable, f'{entry}.py', out_dir] + common, out_dir
+    assert args.eval_dir is not None, "--eval_dir (an output dir of infer_*.py) is needed for " + entry
+    shutil.copytree(args.eval_dir, out_dir, ignore=shutil.ignore_patterns(
+        'evaluation_tmpdir', 'usability_compare_tmpdir', 'evaluation_results.*', 'evaluation_cache.*'
+    ))
+    if entry == 'evaluate_all':
+        return [sys.executable, 'evaluate_all.py', out_dir, '--no_eval_cache'] + common, out_dir
+    return [sys.executable, 'usability.py', os.path.join(out_dir, 't.9')] + common, out_dir
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entry", default=['infer_multiturn_textual'], nargs="+", choices=ENTRY_POINTS)
+    parser.add_argument("--num_workers", default=[1, 4, 16], nargs="+", type=int)
+    parser.add_argument("--eval_dir", default=None, help="inference outputs to evaluate with evaluate_all / usability")
+    parser.add_argument("--out_dir", default=os.path.join(os.environ.get('HOME', './outputs'), "tmp/mock_benchmark"))
+    parser.add_argument("--port", default=18000, type=int)
+    parser.add_argument("--latency", default=1.0, type=float)
+    parser.add_argument("--latency_sigma", default=0.5, type=float)
+    parser.add_argument("--tokens_per_second", default=0., type=float)
+    parser.add_argument("--error_rate", default=0., type=float)
+    parser.add_argument("--overlength_rate", default=0., type=float)
+    args = parser.parse_args()
+
+    # all clients that don't get --local_openai_port (user simulator, drawer) also go to the mock server
+    env = {**os.environ, 'OPENAI_BASE_URL': 'http://localhost:{}/v1'.format(args.port), 'OPENAI_API_KEY': 'mock'}
+
+    table = []
+    for entry in args.entry:
+        for num_workers in args.num_workers:
+            cmd, out_dir = prepare(entry, num_workers, args)
+            server = start_server(args)  # <- fresh server, so that stats are per run
+            try:
+                t0 = time.time()
+                ret = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                elapsed = time.time() - t0
+                stats = get_stats(args)
+            finally:
+                server.kill()
+                server.wait()
+            if ret.returncode != 0:
+                print("{} with {} workers failed:\n{}".format(entry, num_workers, ret.stderr[-2000:]))
+            table.append([
+                entry, num_workers, elapsed, stats['requests'], stats['requests'] / elapsed, stats['max_in_flight'],
+                stats['errors'] + stats['overlength'], 'ok' if ret.returncode == 0 else 'FAILED',
+            ])
+            print(tabulate.tabulate(table[-1:], floatfmt='.2f'), flush=True)
+
+    print(tabulate.tabulate(table, headers=['Entry point', 'Workers', 'Wall time (s)', 'Requests', 'Requests/s',
+                                            'Peak concurrent', 'Injected errors', 'Status'], floatfmt='.2f'))
+
+
+if __name__ == "__main__":
+    main()
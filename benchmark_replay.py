@@ -0,0 +1,73 @@
+import argparse
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import tabulate
+import tqdm
+
+from utils import load_frontalk_dataset
+from webvoyager.replay import replay_session
+from webvoyager.run_evaluate import UsabilityPolicy
+
+# Regression benchmark for the browser side of the agent loop: replays the recorded usability sessions of the
+# reference websites (outputs_comparison_ref) without calling any model, and reports where the time goes.
+
+
+def main_func(data, args):
+    site_dir = os.path.abspath(os.path.join(args.ref_dir, data['id']))
+    task_dir = os.path.join(args.out_dir, data['id'])
+    shutil.rmtree(task_dir, ignore_errors=True)
+    stats = replay_session('file://' + os.path.join(site_dir, 'index.html'),
+                           os.path.join(site_dir, 'usability_compare_tmpdir'),
+                           UsabilityPolicy(data['summary']['purpose']), task_dir)
+    return data['id'], stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ref_dir", default="./outputs_comparison_ref")
+    parser.add_argument("--out_dir", default=os.path.join(os.environ.get('HOME', './outputs'), "tmp/replay_benchmark"))
+    parser.add_argument("--n", default=None, type=int, help="only replay the first n websites")
+    parser.add_argument("--num_workers", default=1, type=int)
+    args = parser.parse_args()
+
+    data = [d for d in load_frontalk_dataset() if os.path.exists(
+        os.path.join(args.ref_dir, d['id'], 'usability_compare_tmpdir', 'interact_messages.json')
+    )]
+    if args.n is not None:
+        data = data[:args.n]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=args.num_workers) as exe:
+        for data_id, stats in tqdm.tqdm(exe.map(main_func, data, [args] * len(data)), total=len(data)):
+            results.append((data_id, stats))
+    if len(results) == 0:
+        print("Nothing to replay in", args.ref_dir)
+        return
+
+    table = []
+    phases = {'observe': [], 'llm': [], 'act': []}
+    for data_id, stats in results:
+        for timings in stats['timings']:
+            for k in phases:
+                if k in timings:
+                    phases[k].append(timings[k])
+        table.append([
+            data_id, '{}/{}'.format(stats['n_replayed'], stats['n_recorded']), len(stats['mismatches']),
+            stats['total'], stats['error'] or '',
+        ])
+    print(tabulate.tabulate(table, headers=['Website', 'Replayed', 'Diverged steps', 'Total (s)', 'Error'],
+                            floatfmt='.2f'))
+    print()
+    print(tabulate.tabulate([
+        [k, len(v), np.sum(v), np.percentile(v, 50), np.percentile(v, 95)] for k, v in phases.items() if len(v) > 0
+    ] + [['session', len(results), np.sum([s['total'] for _, s in results]),
+          np.percentile([s['total'] for _, s in results], 50), np.percentile([s['total'] for _, s in results], 95)]],
+        headers=['Phase', '#', 'Total (s)', 'p50 (s)', 'p95 (s)'], floatfmt='.3f'))
+    print("Per-span details: python aggregate_traces.py {}".format(args.out_dir))
+
+
+if __name__ == "__main__":
+    main()
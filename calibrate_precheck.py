@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import random
+
+import tabulate
+import tqdm
+
+from evaluate_all import N_TURNS_PER_DATA, get_metrics_fname, get_cache_fname, get_condition_and_context
+from utils import load_messages, load_frontalk_dataset
+from webvoyager.static_check import static_precheck, precheck_rule
+
+
+def load_agent_verdicts(args):
+    # (t, id, i, j) -> acc, only for verdicts that come from the full agent (not from the static pre-check)
+    from_cache = set()
+    if os.path.exists(get_cache_fname(args)):
+        with open(get_cache_fname(args)) as f:
+            for line in f:
+                from_cache.add(tuple(json.loads(line)[2]))
+
+    verdicts = {}
+    for t in range(N_TURNS_PER_DATA):
+        if not os.path.exists(get_metrics_fname(args, t)):
+            continue
+        for k, m in load_messages(get_metrics_fname(args, t)).items():
+            for i, j, acc in m:
+                task_dir = os.path.join(args.dir, f't.{t}', k, 'evaluation_tmpdir',
+                                        args.openai_model.replace('/', '__'), f'{i}-{j}')
+                if (t, k, i, j) in from_cache or os.path.exists(os.path.join(task_dir, 'agent.log')):
+                    verdicts[(t, k, i, j)] = int(acc)
+    return verdicts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir")
+    parser.add_argument("--openai_model", default="gpt-4o")
+    parser.add_argument("--eval_cache", default=None)
+    parser.add_argument("--sample", default=1000, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--show_disagreements", default=10, type=int)
+    args = parser.parse_args()
+
+    data = {d['id']: d for d in load_frontalk_dataset()}
+    verdicts = load_agent_verdicts(args)
+    keys = sorted(verdicts.keys())
+    random.Random(args.seed).shuffle(keys)
+    keys = keys[:args.sample]
+    print("Comparing static pre-check against {:d} agent verdicts".format(len(keys)))
+
+    counts = {v: {0: 0, 1: 0} for v in ['PASS', 'FAIL', None]}
+    rule_counts = {}  # <- (rule, verdict) -> {agent verdict: count}
+    disagreements = []
+    for t, k, i, j in tqdm.tqdm(keys):
+        test_conditions, _ = get_condition_and_context(data[k], i, j)
+        verdict, reason = static_precheck(os.path.join(args.dir, f't.{t}', k), test_conditions)
+        agent = verdicts[(t, k, i, j)]
+        counts[verdict][agent] += 1
+        if verdict is not None:
+            rule_counts.setdefault((precheck_rule(reason), verdict), {0: 0, 1: 0})[agent] += 1
+        if verdict is not None and (verdict == 'PASS') != bool(agent):
+            disagreements.append((t, k, i, j, test_conditions['condition'], verdict, reason))
+
+    table = []
+    for v in ['PASS', 'FAIL', None]:
+        n = counts[v][0] + counts[v][1]
+        agree = counts[v][1] if v == 'PASS' else counts[v][0]
+        table.append([
+            v if v is not None else 'escalated', n, '{:.2f}'.format(n / max(len(keys), 1) * 100),
+            counts[v][1], counts[v][0], '-' if v is None or n == 0 else '{:.2f}'.format(agree / n * 100),
+        ])
+    print(tabulate.tabulate(table, headers=['Tier-1 verdict', '#', 'Coverage %', 'Agent PASS', 'Agent FAIL',
+                                            'Agreement %']))
+
+    # precision of each rule, i.e. how often the agent agrees with it
+    table = []
+    for (rule, v), c in sorted(rule_counts.items(), key=lambda x: str(x[0])):
+        n = c[0] + c[1]
+        agree = c[1] if v == 'PASS' else c[0]
+        table.append([rule, v, n, c[1], c[0], '{:.2f}'.format(agree / n * 100)])
+    print(tabulate.tabulate(table, headers=['Rule', 'Tier-1 verdict', '#', 'Agent PASS', 'Agent FAIL', 'Precision %']))
+
+    for t, k, i, j, condition, verdict, reason in disagreements[:args.show_disagreements]:
+        print("- t.{} {} {}-{}: static {} ({}) | {}".format(t, k, i, j, verdict, reason, condition))
+
+
+if __name__ == "__main__":
+    main()
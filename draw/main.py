@@ -9,10 +9,9 @@ import uuid
 from typing import List
 
 from PIL import Image
-from openai import OpenAI
 from selenium.common.exceptions import NoAlertPresentException
 
-from draw.tools import get_html_state, driver_get_safe, CODE_HEAD, CODE_TAIL
+from draw.tools import get_html_state, driver_get_safe, CODE_HEAD, CODE_TAIL, DRAW_TMP_ROOT
 from utils import request, encode_pil_image, encode_image
 from webvoyager.run import get_default_driver
 
@@ -60,8 +59,28 @@ def remove_function_definition(code: str, function_names: List[str]) -> str:
     return new_code
 
 
+def create_attempt_dir(base_dir, key):
+    # Layered workspace: screenshots of the existing website live (read-only) in `base_dir` and are symlinked into each
+    # attempt's scratch dir instead of being copied, so retries only cost a few inodes
+    dirpath = os.path.join(DRAW_TMP_ROOT, key)
+    os.makedirs(dirpath, exist_ok=True)
+    for x in glob.glob(os.path.join(base_dir, '*.png')):
+        dst = os.path.join(dirpath, os.path.basename(x))
+        try:
+            os.symlink(os.path.abspath(x), dst)
+        except OSError:  # <- filesystem without symlink support: fall back to copying
+            shutil.copy(x, dst)
+    return dirpath
+
+
+def seal_base_dir(base_dir):
+    # make base screenshots read-only, so an attempt writing through a symlink can't corrupt the following attempts
+    for x in glob.glob(os.path.join(base_dir, '*.png')):
+        os.chmod(x, 0o444)
+
+
 def run(response, last_code, key):
-    dirpath = os.path.join(os.environ['HOME'], 'tmp', key)
+    dirpath = os.path.join(DRAW_TMP_ROOT, key)
     os.makedirs(dirpath, exist_ok=True)
 
     code = extract_all_code_segments(response)
@@ -88,10 +107,10 @@ def run(response, last_code, key):
 
 
 def read_html_layout(key, last_n_layout):
-    n_layout = len(glob.glob(os.path.join(os.environ['HOME'], 'tmp', key, 'coordinates-*.json')))
+    n_layout = len(glob.glob(os.path.join(DRAW_TMP_ROOT, key, 'coordinates-*.json')))
     ret = []
     for i in range(last_n_layout, n_layout):
-        with open(os.path.join(os.environ['HOME'], 'tmp', key, f'coordinates-{i}.json')) as f:
+        with open(os.path.join(DRAW_TMP_ROOT, key, f'coordinates-{i}.json')) as f:
             ret.append(f.read())
     return n_layout - last_n_layout, ret
 
@@ -111,7 +130,7 @@ USER_PROMPT_EXISTING_WEBSITE = """Information for page {{{PAGE_NAME}}}
 
 def draw(client_kwargs, i, t, data, html_dir=None):
     uuid_key = str(uuid.uuid4())
-    tmp_path = os.path.join(os.environ['HOME'], 'tmp', uuid_key)
+    tmp_path = os.path.join(DRAW_TMP_ROOT, uuid_key)
     os.makedirs(tmp_path, exist_ok=True)
 
     if t == "function":
@@ -170,6 +189,7 @@ def draw(client_kwargs, i, t, data, html_dir=None):
 
         else:
             driver.quit()
+        seal_base_dir(tmp_path)
 
         if len(messages) == 1:
             messages[0]['content'] += "\n\n# Screenshot, HTML and Coordinates of Existing Website" \
@@ -183,9 +203,7 @@ def draw(client_kwargs, i, t, data, html_dir=None):
         n_retry = 0
         while True:
             uuid_key = str(uuid.uuid4())
-            os.makedirs(os.path.join(os.environ['HOME'], 'tmp', uuid_key), exist_ok=True)
-            for x in glob.glob(os.path.join(tmp_path, '*.png')):
-                shutil.copy(x, os.path.join(os.environ['HOME'], 'tmp', uuid_key))
+            attempt_path = create_attempt_dir(tmp_path, uuid_key)
 
             try:
                 # request
@@ -195,7 +213,7 @@ def draw(client_kwargs, i, t, data, html_dir=None):
 
                 # run code
                 last_code = run(response, last_code, uuid_key)
-                image = Image.open(os.path.join(os.environ['HOME'], 'tmp', uuid_key, 'main.png'))
+                image = Image.open(os.path.join(attempt_path, 'main.png'))
                 n_layout, layout_jsons = read_html_layout(uuid_key, last_n_layout)  # <- this is BEFORE rmtree
                 last_n_layout = n_layout
                 break
@@ -203,7 +221,7 @@ def draw(client_kwargs, i, t, data, html_dir=None):
                 print("Generated code has error:")
                 print(e)
             finally:
-                shutil.rmtree(os.path.join(os.environ['HOME'], 'tmp', uuid_key))
+                shutil.rmtree(attempt_path)  # <- only unlinks the symlinks, the base screenshots are kept
 
             n_retry += 1
             if n_retry >= 3:
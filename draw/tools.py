@@ -7,16 +7,20 @@ from collections import OrderedDict
 
 import numpy as np
 from PIL import Image
-from matplotlib import patches
-from matplotlib.text import Annotation
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 
+from webvoyager.lazy import lazy_import
 from webvoyager.run import get_default_driver
 from webvoyager.utils import driver_get_safe, driver_execute_script_safe
 
+patches = lazy_import('matplotlib.patches')  # <- only used by the drawing scripts, which import matplotlib anyway
+
 D = os.path.dirname(__file__)
+# Scratch root for drawing. Set FRONTALK_DRAW_TMPDIR to a tmpfs mount (e.g. /dev/shm/frontalk) to keep screenshots and
+# per-attempt directories off shared disks; the variable is inherited by the generated drawing scripts.
+DRAW_TMP_ROOT = os.environ.get('FRONTALK_DRAW_TMPDIR', os.path.join(os.environ['HOME'], 'tmp'))
 
 CODE_HEAD = """
 import sys
@@ -408,7 +412,7 @@ def get_html_state(driver, image_path, wait_load: int = 1, dont_quit: bool = Fal
     return html, ordered_result
 
 
-def get_html_state_from_file(html_path, image_path, tmp_path=os.path.join(os.environ['HOME'], "tmp")):
+def get_html_state_from_file(html_path, image_path, tmp_path=DRAW_TMP_ROOT):
     driver = get_default_driver(tmp_path=tmp_path)
     # Load your HTML file
     success = driver_get_safe(driver, "file://" + html_path)
@@ -422,7 +426,7 @@ def get_html_state_from_file(html_path, image_path, tmp_path=os.path.join(os.env
 
 
 def layout_visualization(html_code, ax):
-    dirpath = os.path.join(os.environ['HOME'], 'tmp', os.environ['KEY'])
+    dirpath = os.path.join(DRAW_TMP_ROOT, os.environ['KEY'])
     os.makedirs(dirpath, exist_ok=True)
     n_layout = len(glob.glob(os.path.join(dirpath, 'coordinates-*.json')))
     path = os.path.join(dirpath, f'index-{n_layout}.html')
@@ -1,212 +1,471 @@
-import argparse
-import copy
-import multiprocessing
-import os
-import shutil
-import time
-from functools import partial
-
-import numpy as np
-import tabulate
-import tqdm
-
-from utils import load_messages, dump_messages, load_frontalk_dataset
-from webvoyager.run_evaluate import run_evaluate
-
-N_TURNS_PER_DATA = 10
-
-
-def calc_forgetting(results, instruction_type=None):
-    results = [aggregate_metrics(r, suppress_warning=True) for r in results]
-
-    numerator = 0
-    denominator = 0
-    for i in range(N_TURNS_PER_DATA - 1):  # <- per instruction (excluding last one)
-        if instruction_type is not None:
-            n = results[i]['per_inst_and_type'][instruction_type][i]['correct']
-            d = results[-1]['per_inst_and_type'][instruction_type][i]['correct']
-            if n is None or d is None:
-                continue
-        else:
-            n = results[i]['per_inst'][i]['correct']
-            d = results[-1]['per_inst'][i]['correct']
-        numerator += n
-        denominator += d
-    return 1 - denominator / numerator
-
-
-def augment_type_in_metrics(metrics, data):
-    metrics = copy.deepcopy(metrics)
-    for d in data:
-        k = d['id']
-        if k in metrics:
-            metrics[k] = [[i, j, acc, d['cases'][i]['type']] for i, j, acc in metrics[k]]
-    return metrics
-
-
-def aggregate_metrics(metrics, suppress_warning=False, force_complete=False):
-    if 'all' in metrics:  # metrics are already aggregated
-        return metrics
-
-    metrics_all = []
-    metrics_per_inst = [[] for _ in range(10)]
-    metrics_per_type = {'function': [], 'design': []}
-    metrics_per_inst_and_type = {'function': [[] for _ in range(10)], 'design': [[] for _ in range(10)]}
-    for k, m in metrics.items():
-        for i, _, acc, t in m:
-            acc = int(acc)
-            metrics_all.append(acc)
-            metrics_per_inst[i].append(acc)
-            metrics_per_type[t].append(acc)
-            metrics_per_inst_and_type[t][i].append(acc)
-
-    def aggregate(x):
-        if len(x) == 0:
-            return {'correct': None, 'total': None, 'acc': None}
-        else:
-            return {'correct': sum(x), 'total': len(x), 'acc': sum(x) / len(x)}
-
-    if len(metrics_all) != 3676:
-        if not suppress_warning:
-            print(f"This isn't full evaluation. Only has {len(metrics_all)} entries (total should be 3676)")
-        if force_complete:
-            return None
-
-    return {
-        'all': aggregate(metrics_all),
-        'per_inst': [aggregate(x) for x in metrics_per_inst],
-        'per_type': {k: aggregate(v) for k, v in metrics_per_type.items()},
-        'per_inst_and_type': {k: [aggregate(vv) for vv in v] for k, v in metrics_per_inst_and_type.items()}
-    }
-
-
-def display_metrics(metrics):
-    aggregated = aggregate_metrics(metrics)
-
-    def tabulated_line(aggregated):
-        if aggregated is None or aggregated['total'] is None:
-            return ['-', '-', ]
-        else:
-            return ["{:.2f}".format(aggregated['acc'] * 100),
-                    '{:d}/{:d}'.format(aggregated['correct'], aggregated['total'])]
-
-    table = [["Acc. all", ] + tabulated_line(aggregated['all']), '', ] + \
-            [["Acc. Type {:s}".format(k.capitalize()), ] + tabulated_line(aggregated['per_type'][k])
-             for k in ['function', 'design']] + ['', ] + \
-            [["Acc. Instruction {:d}".format(i + 1), ] + tabulated_line(aggregated['per_inst'][i]) for i in range(10)]
-    print(tabulate.tabulate(table))
-
-
-def main_func(o, args):
-    data, i, j = o
-
-    request_kwargs = {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
-                      'local_openai_port': args.local_openai_port}
-
-    test_conditions = data['cases'][i]['test_conditions'][j]
-    context = '\n\n'.join([d['instructions'] for d in data['cases'][:i + 1]])
-
-    filename = os.path.abspath(os.path.join(args.dir, data['id'], 'index.html'))
-    task_dir = os.path.join(args.dir, data['id'], 'evaluation_tmpdir',
-                            args.openai_model.replace('/', '__'), f'{i}-{j}')
-    if os.path.exists(task_dir):
-        shutil.rmtree(task_dir, ignore_errors=True)
-    acc = run_evaluate('file://' + filename, test_conditions, context, request_kwargs, task_dir=task_dir)
-    return data, i, j, acc
-
-
-def evaluate_main(args):
-    data = load_frontalk_dataset()
-
-    metrics_fname = os.path.join(
-        args.dir, 'evaluation_results.{}.jsonl'.format(args.openai_model.replace('/', '__'))
-    )
-    metrics = {}
-    acc_all = []
-    if os.path.exists(metrics_fname):
-        metrics = load_messages(metrics_fname)
-        for k in metrics:
-            acc_all += [acc for i, j, acc in metrics[k]]
-
-    inputs_todo = []
-    for d in data:
-        for i in range(len(d['cases'])):
-            if args.t_start <= i <= args.t_end:
-                for j in range(len(d['cases'][i]['test_conditions'])):
-                    if d['id'] not in metrics or not any([i == i_ and j == j_ for i_, j_, acc in metrics[d['id']]]):
-                        inputs_todo.append((d, i, j))
-
-    if len(inputs_todo) > 0:
-        d_old = data[0]
-        with multiprocessing.Pool(args.num_workers) as p:
-            pbar = tqdm.tqdm(p.imap(partial(main_func, args=args), inputs_todo), total=len(inputs_todo))
-            for d, i, j, acc in pbar:
-                if d['id'] not in metrics:
-                    metrics[d['id']] = []
-                dump_messages(metrics_fname, d['id'], metrics[d['id']], metrics[d['id']] + [[i, j, int(acc)], ])
-                metrics[d['id']].append([i, j, int(acc)])
-
-                acc_all.append(int(acc))
-                if d != d_old:
-                    print("At data {:d}: acc = {:.4f}".format(data.index(d), np.mean(acc_all)))
-                    d_old = d
-                pbar.set_postfix(acc=np.mean(acc_all))
-
-    metrics = augment_type_in_metrics(metrics, data)
-    display_metrics(metrics)
-    return metrics
-
-
-def evaluate_one(args, t):
-    args = copy.deepcopy(args)
-    args.dir = os.path.join(args.dir, f't.{t}')
-    if t == N_TURNS_PER_DATA - 1:
-        args.t_start = 0
-        args.t_end = N_TURNS_PER_DATA
-    else:
-        args.t_start = args.t_end = t
-    print("-" * 10, "Evaluating {}...".format(t))
-
-    while True:
-        try:
-            metrics = evaluate_main(args)
-        except:
-            time.sleep(10)
-        else:
-            break
-
-    return metrics
-
-
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("dir")
-    parser.add_argument("--local_openai_port", default=None)
-    parser.add_argument("--local_openai_key", default=None)
-    parser.add_argument("--openai_model", default="gpt-4o")
-    parser.add_argument("--num_workers", default=16, type=int)
-    parser.add_argument("--last_turn_only", default=False, action="store_true")
-    args = parser.parse_args()
-
-    results_all = [None for _ in range(N_TURNS_PER_DATA)]
-    for t in [N_TURNS_PER_DATA - 1, ] + list(range(N_TURNS_PER_DATA - 1)):
-        results = evaluate_one(args, t)
-        results_all[t] = results
-        if args.last_turn_only:
-            break
-    print("Final accuracy:\n------")
-    display_metrics(results_all[-1])
-    if args.last_turn_only:
-        return
-
-    # Calculate forgetting
-    print()
-    print("Forgetting = {:.2f}".format(calc_forgetting(results_all) * 100))
-    for key in ['function', 'design']:
-        print("{} - Forgetting = {:.2f}".format(
-            key.capitalize(), calc_forgetting(results_all, instruction_type=key) * 100
-        ))
-
-
-if __name__ == "__main__":
-    main()
+import argparse
+import copy
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from functools import partial
+
+import numpy as np
+import tabulate
+import tqdm
+
+from utils import load_messages, dump_messages, load_frontalk_dataset, get_frontalk_dataset, hash_site_dir
+from webvoyager.run_evaluate import run_evaluate, run_evaluate_many
+from webvoyager.static_check import static_precheck
+
+N_TURNS_PER_DATA = 10
+
+
+INSTRUCTION_TYPES = ['function', 'design']
+
+
+def metrics_to_array(results_all, ids=None):
+    """Per-turn results (id -> [[i, j, acc, type], ...], see `augment_type_in_metrics`; None if not evaluated) as arrays.
+
+    Returns `acc` and `mask` of shape (turn, dialogue, case, condition), where `mask` marks evaluated entries, and
+    `case_type` of shape (dialogue, case): index in INSTRUCTION_TYPES, -1 if unknown. Dialogues are in the order of
+    `ids` (default: all ids in `results_all`, sorted), e.g. to align several runs.
+    """
+    if ids is None:
+        ids = sorted({k for metrics in results_all if metrics for k in metrics})
+    id_to_idx = {k: idx for idx, k in enumerate(ids)}
+    entries = [(t, id_to_idx[k], e) for t, metrics in enumerate(results_all) if metrics
+               for k, m in metrics.items() if k in id_to_idx for e in m]
+    n_cases = max([e[0] + 1 for _, _, e in entries] + [N_TURNS_PER_DATA])
+    n_conds = max([e[1] + 1 for _, _, e in entries] + [1])
+
+    acc = np.zeros((N_TURNS_PER_DATA, len(ids), n_cases, n_conds), dtype=np.int8)
+    mask = np.zeros(acc.shape, dtype=bool)
+    case_type = np.full((len(ids), n_cases), -1, dtype=np.int8)
+    if len(entries) > 0:
+        t, d, i, j, a = np.array([(t, d, e[0], e[1], int(e[2])) for t, d, e in entries]).T
+        acc[t, d, i, j] = a
+        mask[t, d, i, j] = True
+        for _, d, e in entries:
+            if len(e) > 3:
+                case_type[d, e[0]] = INSTRUCTION_TYPES.index(e[3])
+    return acc, mask, case_type
+
+
+def per_dialogue_counts(acc, mask):
+    # sufficient statistics per dialogue for all metrics: correct / total per (dialogue, case) at the last turn, and
+    # right after the turn of each case (except the last one)
+    correct = acc * mask
+    diag = np.arange(N_TURNS_PER_DATA - 1)
+    return {
+        'last_correct': correct[-1].sum(-1), 'last_total': mask[-1].sum(-1),
+        'after_correct': correct[diag, :, diag].sum(-1).T, 'after_total': mask[diag, :, diag].sum(-1).T,
+    }
+
+
+def metrics_from_counts(counts, case_type, weights=None):
+    """Accuracy (overall, per type, per instruction) and forgetting from `per_dialogue_counts`, with dialogues weighted
+    by `weights` (n_samples, dialogue), e.g. bootstrap resampling counts; by default one sample with all weights 1.
+
+    Same definitions as `aggregate_metrics` and `calc_forgetting`. Returns arrays of shape (n_samples, ...)."""
+    if weights is None:
+        weights = np.ones((1, case_type.shape[0]))
+    n = N_TURNS_PER_DATA - 1
+
+    def ratio(num, den):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return num / den
+
+    ret = {}
+    for name, type_mask in [('', np.ones(case_type.shape, dtype=bool))] + \
+                           [('_' + k, case_type == idx) for idx, k in enumerate(INSTRUCTION_TYPES)]:
+        last_correct = weights @ (counts['last_correct'] * type_mask)  # <- (n_samples, case)
+        last_total = weights @ (counts['last_total'] * type_mask)
+        ret['acc' + name] = ratio(last_correct.sum(-1), last_total.sum(-1))
+        if name == '':
+            ret['acc_per_inst'] = ratio(last_correct, last_total)
+
+        # forgetting: 1 - (correct at the last turn) / (correct right after the turn), over instructions evaluated at both
+        after_correct = weights @ (counts['after_correct'] * type_mask[:, :n])
+        after_total = weights @ (counts['after_total'] * type_mask[:, :n])
+        valid = (after_total > 0) & (last_total[:, :n] > 0)
+        ret['forgetting' + name] = 1 - ratio((last_correct[:, :n] * valid).sum(-1), (after_correct * valid).sum(-1))
+    return ret
+
+
+N_BOOTSTRAP = 1000
+METRICS = [("Acc. all", 'acc'), ] + \
+          [("Acc. Type {}".format(k.capitalize()), 'acc_' + k) for k in INSTRUCTION_TYPES] + \
+          [("Forgetting", 'forgetting'), ] + \
+          [("{} - Forgetting".format(k.capitalize()), 'forgetting_' + k) for k in INSTRUCTION_TYPES]
+
+
+def cluster_bootstrap_weights(n_dialogues, n_bootstrap=N_BOOTSTRAP, seed=0):
+    # (n_bootstrap, n_dialogues): how many times each dialogue is drawn in each resampling. Dialogues are the unit of
+    # resampling: test cases of the same dialogue are evaluated on the same websites and are not independent
+    rng = np.random.default_rng(seed)
+    return rng.multinomial(n_dialogues, np.full(n_dialogues, 1 / n_dialogues), size=n_bootstrap)
+
+
+def confidence_intervals(acc, mask, case_type, n_bootstrap=N_BOOTSTRAP, alpha=0.05, seed=0):
+    """metric -> (estimate, low, high) for all `METRICS` with results, from `metrics_from_counts` on `n_bootstrap`
+    resamplings of the dialogues, in one vectorised pass."""
+    counts = per_dialogue_counts(acc, mask)
+    point = metrics_from_counts(counts, case_type)
+    samples = metrics_from_counts(counts, case_type, cluster_bootstrap_weights(len(case_type), n_bootstrap, seed))
+    ret = {}
+    for _, key in METRICS:
+        if not np.isnan(point[key][0]):
+            low, high = np.nanpercentile(samples[key], [alpha / 2 * 100, (1 - alpha / 2) * 100])
+            ret[key] = (point[key][0], low, high)
+    return ret
+
+
+def display_confidence_intervals(results_all, n_bootstrap=N_BOOTSTRAP, alpha=0.05):
+    ret = confidence_intervals(*metrics_to_array(results_all), n_bootstrap=n_bootstrap, alpha=alpha)
+    table = [[name, "{:.2f}".format(ret[key][0] * 100), "[{:.2f}, {:.2f}]".format(ret[key][1] * 100, ret[key][2] * 100)]
+             for name, key in METRICS if key in ret]
+    print("{:d}% confidence intervals ({:d} bootstrap resamplings of dialogues):".format(
+        int(round((1 - alpha) * 100)), n_bootstrap
+    ))
+    print(tabulate.tabulate(table, disable_numparse=True))
+
+
+def calc_forgetting(results, instruction_type=None):
+    acc, mask, case_type = metrics_to_array(results)
+    metrics = metrics_from_counts(per_dialogue_counts(acc, mask), case_type)
+    return metrics['forgetting' if instruction_type is None else 'forgetting_' + instruction_type][0]
+
+
+def augment_type_in_metrics(metrics, data):
+    metrics = copy.deepcopy(metrics)
+    for d in data:
+        k = d['id']
+        if k in metrics:
+            metrics[k] = [[i, j, acc, d['cases'][i]['type']] for i, j, acc in metrics[k]]
+    return metrics
+
+
+def aggregate_metrics(metrics, suppress_warning=False, force_complete=False):
+    if 'all' in metrics:  # metrics are already aggregated
+        return metrics
+
+    metrics_all = []
+    metrics_per_inst = [[] for _ in range(10)]
+    metrics_per_type = {'function': [], 'design': []}
+    metrics_per_inst_and_type = {'function': [[] for _ in range(10)], 'design': [[] for _ in range(10)]}
+    for k, m in metrics.items():
+        for i, _, acc, t in m:
+            acc = int(acc)
+            metrics_all.append(acc)
+            metrics_per_inst[i].append(acc)
+            metrics_per_type[t].append(acc)
+            metrics_per_inst_and_type[t][i].append(acc)
+
+    def aggregate(x):
+        if len(x) == 0:
+            return {'correct': None, 'total': None, 'acc': None}
+        else:
+            return {'correct': sum(x), 'total': len(x), 'acc': sum(x) / len(x)}
+
+    if len(metrics_all) != 3676:
+        if not suppress_warning:
+            print(f"This isn't full evaluation. Only has {len(metrics_all)} entries (total should be 3676)")
+        if force_complete:
+            return None
+
+    return {
+        'all': aggregate(metrics_all),
+        'per_inst': [aggregate(x) for x in metrics_per_inst],
+        'per_type': {k: aggregate(v) for k, v in metrics_per_type.items()},
+        'per_inst_and_type': {k: [aggregate(vv) for vv in v] for k, v in metrics_per_inst_and_type.items()}
+    }
+
+
+def display_metrics(metrics):
+    aggregated = aggregate_metrics(metrics)
+
+    def tabulated_line(aggregated):
+        if aggregated is None or aggregated['total'] is None:
+            return ['-', '-', ]
+        else:
+            return ["{:.2f}".format(aggregated['acc'] * 100),
+                    '{:d}/{:d}'.format(aggregated['correct'], aggregated['total'])]
+
+    table = [["Acc. all", ] + tabulated_line(aggregated['all']), '', ] + \
+            [["Acc. Type {:s}".format(k.capitalize()), ] + tabulated_line(aggregated['per_type'][k])
+             for k in ['function', 'design']] + ['', ] + \
+            [["Acc. Instruction {:d}".format(i + 1), ] + tabulated_line(aggregated['per_inst'][i]) for i in range(10)]
+    print(tabulate.tabulate(table))
+
+
+def get_condition_and_context(data, i, j):
+    test_conditions = data['cases'][i]['test_conditions'][j]
+    context = '\n\n'.join([d['instructions'] for d in data['cases'][:i + 1]])
+    return test_conditions, context
+
+
+def main_func(batch, args):
+    # `batch`: tasks of the same (turn, dialogue) to evaluate in one browser with --share_browser, else a single task
+    request_kwargs = {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
+                      'local_openai_port': args.local_openai_port}
+
+    results = []
+    agent_tasks = []
+    for o in batch:
+        t, data_id, i, j = o
+        data = get_frontalk_dataset()[data_id]  # <- tasks only carry ids, records are read in the worker
+        test_conditions, context = get_condition_and_context(data, i, j)
+
+        turn_dir = os.path.join(args.dir, f't.{t}')
+        filename = os.path.abspath(os.path.join(turn_dir, data_id, 'index.html'))
+        task_dir = os.path.join(turn_dir, data_id, 'evaluation_tmpdir',
+                                args.openai_model.replace('/', '__'), f'{i}-{j}')
+        if os.path.exists(task_dir):
+            shutil.rmtree(task_dir, ignore_errors=True)
+
+        if args.static_precheck:  # <- tier 1: decide obvious cases from the website source, without an agent session
+            verdict, reason = static_precheck(os.path.dirname(filename), test_conditions)
+            if verdict is not None:
+                os.makedirs(task_dir, exist_ok=True)
+                with open(os.path.join(task_dir, 'precheck.json'), 'w') as f:
+                    json.dump({'verdict': verdict, 'reason': reason}, f, indent=2)
+                results.append((t, data_id, i, j, verdict == 'PASS', 'static'))
+                continue
+        agent_tasks.append((o, filename, test_conditions, context, task_dir))
+
+    if len(agent_tasks) == 1:
+        o, filename, test_conditions, context, task_dir = agent_tasks[0]
+        accs = [run_evaluate('file://' + filename, test_conditions, context, request_kwargs, task_dir=task_dir,
+                             accessibility_tree=args.accessibility_tree), ]
+    elif len(agent_tasks) > 1:
+        filename = agent_tasks[0][1]
+        accs = run_evaluate_many('file://' + filename, [x[2:] for x in agent_tasks], request_kwargs,
+                                 accessibility_tree=args.accessibility_tree)
+    else:
+        accs = []
+    results += [(*x[0], acc, 'agent') for x, acc in zip(agent_tasks, accs)]
+    return results
+
+
+def make_batches(inputs_run, share_browser=False):
+    if not share_browser:
+        return [[o, ] for o in inputs_run]
+    batches = {}
+    for o in inputs_run:
+        batches.setdefault(o[:2], []).append(o)  # <- group by (turn, dialogue), keeping the queue order
+    return list(batches.values())
+
+
+def turn_range(t):
+    # the last turn is evaluated on all instructions; intermediate turns only on their own instruction (for forgetting)
+    if t == N_TURNS_PER_DATA - 1:
+        return 0, N_TURNS_PER_DATA
+    else:
+        return t, t
+
+
+def get_metrics_fname(args, t):
+    return os.path.join(
+        args.dir, f't.{t}', 'evaluation_results.{}.jsonl'.format(args.openai_model.replace('/', '__'))
+    )
+
+
+def get_cache_fname(args):
+    if args.eval_cache is not None:
+        return args.eval_cache
+    return os.path.join(args.dir, 'evaluation_cache.{}.jsonl'.format(args.openai_model.replace('/', '__')))
+
+
+def load_eval_cache(fname):
+    cache = {}
+    if os.path.exists(fname):
+        with open(fname) as f:
+            for line in f:
+                key, acc = json.loads(line)[:2]
+                cache[key] = acc
+    return cache
+
+
+def get_task_key(site_hash, data, i, j, model):
+    # identical website + test condition + context + evaluator -> identical evaluation task
+    test_conditions, context = get_condition_and_context(data, i, j)
+    return hashlib.sha256(json.dumps([site_hash, test_conditions, context, model]).encode()).hexdigest()
+
+
+def collect_todo(data, done, t):
+    t_start, t_end = turn_range(t)
+    inputs_todo = []
+    for d in data:
+        for i in range(len(d['cases'])):
+            if t_start <= i <= t_end:
+                for j in range(len(d['cases'][i]['test_conditions'])):
+                    if (d['id'], i, j) not in done:
+                        inputs_todo.append((t, d['id'], i, j))
+    return inputs_todo
+
+
+def evaluate_main(args, turns):
+    """Evaluate all `turns` with a single global queue of (turn, dialogue, i, j) tasks fed to one persistent pool.
+
+    Per-turn metrics are displayed as soon as the last task of that turn finishes.
+    """
+    data = load_frontalk_dataset()
+    id_to_idx = {d['id']: idx for idx, d in enumerate(data)}
+
+    metrics_all = {}
+    acc_all = {}
+    inputs_todo = []
+    n_todo = {}
+    for t in turns:
+        metrics_all[t] = {}
+        acc_all[t] = []
+        if os.path.exists(get_metrics_fname(args, t)):
+            metrics_all[t] = load_messages(get_metrics_fname(args, t))
+            for k in metrics_all[t]:
+                acc_all[t] += [acc for i, j, acc in metrics_all[t][k]]
+        done = {(k, i, j) for k in metrics_all[t] for i, j, acc in metrics_all[t][k]}
+        inputs_todo_t = collect_todo(data, done, t)
+        n_todo[t] = len(inputs_todo_t)
+        inputs_todo += inputs_todo_t  # <- queue in the order of `turns`, so the final turn is prioritized
+
+    def finalize(t):
+        print("-" * 10, "Evaluated {}".format(t))
+        display_metrics(augment_type_in_metrics(metrics_all[t], data))
+
+    id_old = {t: data[0]['id'] for t in turns}
+
+    def record(t, data_id, i, j, acc):
+        metrics = metrics_all[t]
+        if data_id not in metrics:
+            metrics[data_id] = []
+        dump_messages(get_metrics_fname(args, t), data_id, metrics[data_id], metrics[data_id] + [[i, j, int(acc)], ])
+        metrics[data_id].append([i, j, int(acc)])
+
+        acc_all[t].append(int(acc))
+        if data_id != id_old[t]:
+            print("At t.{:d} data {:d}: acc = {:.4f}".format(t, id_to_idx[data_id], np.mean(acc_all[t])))
+            id_old[t] = data_id
+
+        n_todo[t] -= 1
+        if n_todo[t] == 0:
+            finalize(t)
+
+    for t in turns:
+        if n_todo[t] == 0:
+            finalize(t)
+
+    # Deduplicate: t.{i} is copied from t.{i-1}, so the same condition is often evaluated against a byte-identical
+    # website. Only one representative per task key is run; the others reuse its result (also across runs, via cache)
+    key_to_tasks = {}
+    n_cached = 0
+    if args.no_eval_cache:
+        inputs_run = inputs_todo
+    else:
+        cache_fname = get_cache_fname(args)
+        cache = load_eval_cache(cache_fname)
+        site_hashes = {}
+        inputs_run = []
+        for o in inputs_todo:
+            t, data_id, i, j = o
+            if (t, data_id) not in site_hashes:
+                site_hashes[(t, data_id)] = hash_site_dir(os.path.join(args.dir, f't.{t}', data_id))
+            key = get_task_key(site_hashes[(t, data_id)], data[id_to_idx[data_id]], i, j, args.openai_model)
+            if key in cache:
+                record(*o, cache[key])
+                n_cached += 1
+            elif key in key_to_tasks:
+                key_to_tasks[key].append(o)
+            else:
+                key_to_tasks[key] = [o, ]
+                inputs_run.append(o)
+        task_to_key = {tasks[0]: key for key, tasks in key_to_tasks.items()}
+    print("Skipped {:d} out of {:d} agent sessions ({:d} cached, {:d} duplicated)".format(
+        len(inputs_todo) - len(inputs_run), len(inputs_todo), n_cached, len(inputs_todo) - len(inputs_run) - n_cached
+    ))
+
+    n_tier = {'static': 0, 'agent': 0}
+    if len(inputs_run) > 0:
+        with multiprocessing.Pool(args.num_workers) as p:
+            pbar = tqdm.tqdm(total=len(inputs_run))
+            for results in p.imap_unordered(partial(main_func, args=args),
+                                            make_batches(inputs_run, args.share_browser)):
+                for t, data_id, i, j, acc, tier in results:
+                    n_tier[tier] += 1
+                    if args.no_eval_cache:
+                        record(t, data_id, i, j, acc)
+                    else:
+                        key = task_to_key[(t, data_id, i, j)]
+                        if tier == 'agent':  # <- static verdicts are cheap to recompute, only cache the agent's
+                            with open(cache_fname, 'a') as f:
+                                f.write(json.dumps([key, int(acc), [t, data_id, i, j]]) + '\n')
+                        for o in key_to_tasks[key]:
+                            record(*o, acc)
+                pbar.update(len(results))
+                pbar.set_postfix(acc=np.mean(acc_all[turns[0]]) if acc_all[turns[0]] else None)
+
+    if args.static_precheck:
+        print("Static pre-check decided {:d} out of {:d} tasks without an agent session".format(
+            n_tier['static'], n_tier['static'] + n_tier['agent']
+        ))
+
+    return {t: augment_type_in_metrics(metrics_all[t], data) for t in turns}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir")
+    parser.add_argument("--local_openai_port", default=None)
+    parser.add_argument("--local_openai_key", default=None)
+    parser.add_argument("--openai_model", default="gpt-4o")
+    parser.add_argument("--num_workers", default=16, type=int)
+    parser.add_argument("--last_turn_only", default=False, action="store_true")
+    parser.add_argument("--eval_cache", default=None,
+                        help="cache of evaluation results keyed by website content, test condition, context and "
+                             "evaluator model; default: dir/evaluation_cache.<openai_model>.jsonl")
+    parser.add_argument("--no_eval_cache", default=False, action="store_true")
+    parser.add_argument("--static_precheck", default=False, action="store_true",
+                        help="decide obvious test conditions from the website source before running the agent; "
+                             "check its accuracy with calibrate_precheck.py")
+    parser.add_argument("--share_browser", default=False, action="store_true",
+                        help="evaluate all test cases of the same website one after the other in one browser, "
+                             "resetting it in between, instead of opening a browser per test case")
+    parser.add_argument("--accessibility_tree", default="off", choices=["off", "sync", "background"],
+                        help="save the accessibility tree of each step for archival (not used by the evaluator)")
+    parser.add_argument("--n_bootstrap", default=N_BOOTSTRAP, type=int,
+                        help="bootstrap resamplings of dialogues for confidence intervals; 0 to disable")
+    args = parser.parse_args()
+
+    turns = [N_TURNS_PER_DATA - 1, ]
+    if not args.last_turn_only:
+        turns += list(range(N_TURNS_PER_DATA - 1))
+
+    while True:
+        try:
+            results = evaluate_main(args, turns)
+        except:
+            time.sleep(10)
+        else:
+            break
+
+    results_all = [results.get(t) for t in range(N_TURNS_PER_DATA)]
+    print("Final accuracy:\n------")
+    display_metrics(results_all[-1])
+    if args.last_turn_only:
+        if args.n_bootstrap > 0:
+            print()
+            display_confidence_intervals(results_all, n_bootstrap=args.n_bootstrap)
+        return
+
+    # Calculate forgetting
+    print()
+    print("Forgetting = {:.2f}".format(calc_forgetting(results_all) * 100))
+    for key in ['function', 'design']:
+        print("{} - Forgetting = {:.2f}".format(
+            key.capitalize(), calc_forgetting(results_all, instruction_type=key) * 100
+        ))
+    if args.n_bootstrap > 0:
+        print()
+        display_confidence_intervals(results_all, n_bootstrap=args.n_bootstrap)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,19 @@ from concurrent.futures import ProcessPoolExecutor, as_completed
 import tqdm
 
 from infer_multiturn_textual import (
-    PROMPT, N_TURNS_PER_DATA, simulate_user, get_simple_navigation
+    PROMPT, N_TURNS_PER_DATA, simulate_user, dump_navigation, dump_navigation_fragment
 )
 from utils import (
-    parse_files, dump_files, load_frontalk_dataset, n_turns, load_messages, dump_messages, request_with_truncation
+    parse_files, dump_files, load_frontalk_dataset, get_frontalk_dataset, n_turns, load_messages, dump_messages,
+    request_with_truncation
 )
-from webvoyager.run_acecoder import run_verify_instruction
+from webvoyager.run_acecoder import run_verify_instructions
 
 REFINE_PROMPT = "---\n\nIn addition to following the instructions above, also consider the feedback below:"
 
 
-def main_func(data, args, messages):
+def main_func(data_id, args, messages):
+    data = get_frontalk_dataset()[data_id]  # <- tasks only carry the id, the record is read in the worker
     request_kwargs = {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
                       'local_openai_port': args.local_openai_port}
     if args.max_tokens is not None:
@@ -54,27 +56,33 @@ def main_func(data, args, messages):
     files = parse_files(response, out_dirname_)
     dump_files(files, out_dirname_)
 
-    # New, ours: reflect
-    reflect_msg = ''
-    reflect_all_outputs = {}
-    task_dir = os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.curr')
-    shutil.rmtree(task_dir, ignore_errors=True)
-    met, reason = run_verify_instruction(
+    # New, ours: reflect. Instructions of the current and all previous turns are verified concurrently
+    instructions_all = {'current': msg}
+    task_dirs = {'current': os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.curr')}
+    for i_ in range(i):
+        instructions_all[i_] = messages[i_ * 2 + 1]['content']
+        task_dirs[i_] = os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.{i_}')
+    for task_dir in task_dirs.values():
+        shutil.rmtree(task_dir, ignore_errors=True)
+    verify_cache_kwargs = {}
+    if args.verify_cache != 'off':  # <- skip instructions whose verification still holds for this website
+        os.makedirs(os.path.join(args.out_dirname, 'ours_tmpdir', data['id']), exist_ok=True)
+        verify_cache_kwargs = dict(
+            site_dir=out_dirname_, carry_forward=args.verify_cache == 'incremental',
+            cache_fname=os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], 'verify_cache.jsonl'),
+        )
+    reflect_all_outputs = run_verify_instructions(
         'file://' + os.path.abspath(os.path.join(out_dirname_, 'index.html')), data['summary']['purpose'],
-        msg, request_kwargs={**request_kwargs, 'max_tokens': 1000}, task_dir=task_dir
+        instructions_all, {**request_kwargs, 'max_tokens': 1000}, task_dirs, max_workers=args.verify_workers, **verify_cache_kwargs,
     )
-    reflect_all_outputs['current'] = (met, reason)
+
+    reflect_msg = ''
+    met, reason = reflect_all_outputs['current']
     if not met:
         reflect_msg = "## Feedback for Instructions at Current Turn\n" + reason
     for i_ in range(i):
-        task_dir = os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.{i_}')
-        shutil.rmtree(task_dir, ignore_errors=True)
-        msg = messages[i_ * 2 + 1]['content']
-        met, reason = run_verify_instruction(
-            'file://' + os.path.abspath(os.path.join(out_dirname_, 'index.html')), data['summary']['purpose'],
-            msg, request_kwargs={**request_kwargs, 'max_tokens': 1000}, task_dir=task_dir
-        )
-        reflect_all_outputs[i_] = (met, reason)
+        msg = instructions_all[i_]
+        met, reason = reflect_all_outputs[i_]
         if not met:
             reflect_msg += "\n\n### Instructions at Turn {:d}\n{}\n\n### Feedback for Instructions at Turn {:d}\n{}".format(
                 i_ + 1, msg, i_ + 1, reason
@@ -103,7 +111,7 @@ def main_func(data, args, messages):
         dump_files(files, out_dirname_)
 
     messages.append({"role": "assistant", "content": response})
-    return data, messages, i == N_TURNS_PER_DATA - 1
+    return data_id, messages, i == N_TURNS_PER_DATA - 1
 
 
 def main_(args):
@@ -118,30 +126,28 @@ def main_(args):
         print("Load existing messages:", messages_fname)
         messages_all = load_messages(messages_fname)
         total = sum([N_TURNS_PER_DATA - n_turns(messages_all.get(d['id'])) for d in data])
-    with open(os.path.join(args.out_dirname, "navigation.html"), "w") as f:
-        f.write(get_simple_navigation(data, messages_all))
+    dump_navigation(args.out_dirname, data, messages_all)
 
     finished_all = {d['id']: n_turns(messages_all.get(d['id'])) == N_TURNS_PER_DATA for d in data}
     pbar = tqdm.tqdm(total=total)
     with ProcessPoolExecutor(max_workers=args.num_workers) as exe:
         # map each future -> its (x,i) so we know how to chain
-        future_to_args = [exe.submit(main_func, d, args, messages_all.get(d['id'], []))
+        future_to_args = [exe.submit(main_func, d['id'], args, messages_all.get(d['id'], []))
                           for d in data if not finished_all[d['id']]]
         while not all(finished_all.values()):
             # wait for the next future to complete
             fut = next(as_completed(future_to_args))
-            d, messages, finished = fut.result()
+            data_id, messages, finished = fut.result()
+            d = get_frontalk_dataset()[data_id]
             dump_messages(messages_fname, d['id'], messages_all.get(d['id']), messages)
             messages_all[d['id']] = messages
             finished_all[d['id']] = finished
             # remove the completed future
             future_to_args.remove(fut)
             if not finished:
-                future_to_args.append(exe.submit(main_func, d, args, messages_all[d['id']]))
+                future_to_args.append(exe.submit(main_func, d['id'], args, messages_all[d['id']]))
+            dump_navigation_fragment(args.out_dirname, d['id'], messages)  # <- only this dialogue changed
             pbar.update()
-            if pbar.n % 20 == 0:
-                with open(os.path.join(args.out_dirname, "navigation.html"), "w") as f:
-                    f.write(get_simple_navigation(data, messages_all))
 
 
 def main():
@@ -153,6 +159,12 @@ def main():
     parser.add_argument("--num_workers", default=16, type=int)
     parser.add_argument("--max_tokens", default=None, type=int)
     parser.add_argument("--keep_retrying", default=False, action="store_true")
+    parser.add_argument("--verify_workers", default=4, type=int,
+                        help="browsers per worker to verify instructions of previous turns concurrently")
+    parser.add_argument("--verify_cache", default="off", choices=["off", "exact", "incremental"],
+                        help="reuse verifications of instructions on identical websites (exact), and also carry "
+                             "forward PASS verdicts when no file loaded by the pages the verifier was on has changed "
+                             "(incremental)")
     args = parser.parse_args()
     args.user_model = 'gpt-4o'  # <- hardcode as gpt-4o
 
@@ -8,21 +8,24 @@ from concurrent.futures import ProcessPoolExecutor, as_completed
 import tqdm
 
 from draw.main import draw
-from infer_multiturn_visual import PROMPT, PROMPTS_BY_ASPECT, N_TURNS_PER_DATA, get_simple_navigation
+from infer_multiturn_visual import PROMPT, PROMPTS_BY_ASPECT, N_TURNS_PER_DATA, get_simple_navigation, \
+    get_image_store_dir
 from utils import (
-    parse_files, dump_files, load_frontalk_dataset, encode_pil_image, n_turns, load_messages, dump_messages,
-    request_with_truncation,
+    parse_files, dump_files, load_frontalk_dataset, get_frontalk_dataset, store_image, image_ref, resolve_image_ref,
+    n_turns, load_messages, dump_messages, request_with_truncation,
 )
-from webvoyager.run_acecoder import run_verify_instruction
+from webvoyager.run_acecoder import run_verify_instructions
 
 REFINE_PROMPT = "In addition to following the instructions in the image, also consider the feedback below, but **please prioritize the image**!"
 
 
-def main_func(data, args, messages):
+def main_func(data_id, args, messages):
+    data = get_frontalk_dataset()[data_id]  # <- tasks only carry the id, the record is read in the worker
     request_kwargs = {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
                       'local_openai_port': args.local_openai_port}
     if args.max_tokens is not None:
         request_kwargs['max_tokens'] = args.max_tokens
+    request_kwargs['image_root'] = os.path.abspath(args.out_dirname)  # <- image references are relative to it
     drawer_kwargs = dict(model=args.drawer_model)
 
     if len(messages) == 0:  # initialize message
@@ -52,7 +55,8 @@ def main_func(data, args, messages):
     ]})
     if image is not None:
         image.save(os.path.join(draw_out_dirname, f'{i}.png'))
-        msg = {'url': "data:image/png;base64,{}".format(encode_pil_image(image))}
+        # reference relative to out_dirname, expanded only when requesting
+        msg = {'url': store_image(image, get_image_store_dir(args), root=args.out_dirname)}
         messages[-1]['content'].append({"type": "image_url", "image_url": msg})
     else:
         msg = None
@@ -70,33 +74,42 @@ def main_func(data, args, messages):
     files = parse_files(response, out_dirname_)
     dump_files(files, out_dirname_)
 
-    # New, ours: reflect
-    reflect_all_outputs = {}
-    met = True
-    reason = ''
+    # New, ours: reflect. Instructions of the current and all previous turns are verified concurrently
+    instructions_all = {}
+    task_dirs = {}
     if msg is not None:
-        task_dir = os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.curr')
+        instructions_all['current'] = msg
+    task_dirs['current'] = os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.curr')
+    for i_ in range(i):
+        task_dirs[i_] = os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.{i_}')
+        if len(messages[i_ * 2 + 1]['content']) > 1:
+            instructions_all[i_] = messages[i_ * 2 + 1]['content'][1]['image_url']
+    # absolute references for the verifier, whose logs are saved relative to its own task_dir
+    instructions_all = {k: {**v, 'url': image_ref(resolve_image_ref(v['url'], args.out_dirname))}
+                        if v['url'].startswith('file:') else v for k, v in instructions_all.items()}
+    for task_dir in task_dirs.values():
         shutil.rmtree(task_dir, ignore_errors=True)
-        met, reason = run_verify_instruction(
-            'file://' + os.path.abspath(os.path.join(out_dirname_, 'index.html')), data['summary']['purpose'],
-            msg, request_kwargs={**request_kwargs, 'max_tokens': 2000}, task_dir=task_dir, is_image=True,
+    verify_cache_kwargs = {}
+    if args.verify_cache != 'off':  # <- skip instructions whose verification still holds for this website
+        os.makedirs(os.path.join(args.out_dirname, 'ours_tmpdir', data['id']), exist_ok=True)
+        verify_cache_kwargs = dict(
+            site_dir=out_dirname_, carry_forward=args.verify_cache == 'incremental',
+            cache_fname=os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], 'verify_cache.jsonl'),
         )
-        reflect_all_outputs['current'] = (met, reason)
+    reflect_all_outputs = run_verify_instructions(
+        'file://' + os.path.abspath(os.path.join(out_dirname_, 'index.html')), data['summary']['purpose'],
+        instructions_all, {**request_kwargs, 'max_tokens': 2000}, task_dirs, is_image=True,
+        max_workers=args.verify_workers, **verify_cache_kwargs,
+    )
 
     reflect_msg = ''
+    met, reason = reflect_all_outputs.get('current', (True, ''))
     if not met:
         reflect_msg = "## Feedback for Instructions at Current Turn\n" + reason
     for i_ in range(i):
-        task_dir = os.path.join(args.out_dirname, 'ours_tmpdir', data['id'], f't.{i}-reflect.{i_}')
-        shutil.rmtree(task_dir, ignore_errors=True)
-        if len(messages[i_ * 2 + 1]['content']) == 1:
+        if i_ not in reflect_all_outputs:
             continue
-        msg = messages[i_ * 2 + 1]['content'][1]['image_url']
-        met, reason = run_verify_instruction(
-            'file://' + os.path.abspath(os.path.join(out_dirname_, 'index.html')), data['summary']['purpose'],
-            msg, request_kwargs={**request_kwargs, 'max_tokens': 2000}, task_dir=task_dir, is_image=True,
-        )
-        reflect_all_outputs[i_] = (met, reason)
+        met, reason = reflect_all_outputs[i_]
         if not met:
             reflect_msg += "\n\n### Feedback for Instructions at Turn {:d}\n{}".format(i_ + 1, reason)
     with open(os.path.join(out_dirname_, 'reflect.json'), 'w') as f:
@@ -123,7 +136,7 @@ def main_func(data, args, messages):
         dump_files(files, out_dirname_)
 
     messages.append({"role": "assistant", "content": response})
-    return data, messages, i == N_TURNS_PER_DATA - 1
+    return data_id, messages, i == N_TURNS_PER_DATA - 1
 
 
 def main_(args):
@@ -145,19 +158,20 @@ def main_(args):
     pbar = tqdm.tqdm(total=total)
     with ProcessPoolExecutor(max_workers=args.num_workers) as exe:
         # map each future -> its (x,i) so we know how to chain
-        future_to_args = [exe.submit(main_func, d, args, messages_all.get(d['id'], []))
+        future_to_args = [exe.submit(main_func, d['id'], args, messages_all.get(d['id'], []))
                           for d in data if not finished_all[d['id']]]
         while not all(finished_all.values()):
             # wait for the next future to complete
             fut = next(as_completed(future_to_args))
-            d, messages, finished = fut.result()
+            data_id, messages, finished = fut.result()
+            d = get_frontalk_dataset()[data_id]
             dump_messages(messages_fname, d['id'], messages_all.get(d['id']), messages)
             messages_all[d['id']] = messages
             finished_all[d['id']] = finished
             # remove the completed future
             future_to_args.remove(fut)
             if not finished:
-                future_to_args.append(exe.submit(main_func, d, args, messages_all[d['id']]))
+                future_to_args.append(exe.submit(main_func, d['id'], args, messages_all[d['id']]))
             pbar.update()
 
 
@@ -170,6 +184,12 @@ def main():
     parser.add_argument("--num_workers", default=16, type=int)
     parser.add_argument("--max_tokens", default=None, type=int)
     parser.add_argument("--keep_retrying", default=False, action="store_true")
+    parser.add_argument("--verify_workers", default=4, type=int,
+                        help="browsers per worker to verify instructions of previous turns concurrently")
+    parser.add_argument("--verify_cache", default="off", choices=["off", "exact", "incremental"],
+                        help="reuse verifications of instructions on identical websites (exact), and also carry "
+                             "forward PASS verdicts when no file loaded by the pages the verifier was on has changed "
+                             "(incremental)")
     args = parser.parse_args()
     args.drawer_model = 'gpt-4o'  # <- hardcode as gpt-4o
 
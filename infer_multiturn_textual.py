@@ -1,4 +1,5 @@
 import argparse
+import json
 import os
 import shutil
 import time
@@ -7,8 +8,8 @@ from concurrent.futures import ProcessPoolExecutor, as_completed
 import tqdm
 
 from utils import (
-    parse_files, dump_files, load_frontalk_dataset, request, n_turns, load_messages, dump_messages,
-    request_with_truncation
+    parse_files, dump_files, load_frontalk_dataset, get_frontalk_dataset, request, n_turns, load_messages,
+    dump_messages, request_with_truncation
 )
 
 PROMPT = """Write a website based on the instructions below. Requirements:
@@ -101,7 +102,8 @@ def simulate_user(user_kwargs, i, data, html_dir=None):
             return response
 
 
-def main_func(data, args, messages):
+def main_func(data_id, args, messages):
+    data = get_frontalk_dataset()[data_id]  # <- tasks only carry the id, the record is read in the worker
     request_kwargs = {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
                       'local_openai_port': args.local_openai_port}
     if args.max_tokens is not None:
@@ -138,10 +140,15 @@ def main_func(data, args, messages):
     files = parse_files(response, out_dirname_)
     dump_files(files, out_dirname_)
 
-    return data, messages, i == N_TURNS_PER_DATA - 1
+    return data_id, messages, i == N_TURNS_PER_DATA - 1
 
 
-def get_simple_navigation(data, messages=None):
+NAVIGATION_FRAGMENT_DIR = 'navigation'
+
+
+def get_simple_navigation(data):
+    # static shell: the messages of each dialogue are loaded from `navigation/<id>.js` (see `dump_navigation_fragment`)
+    # when its table is scrolled into view, so the page stays small and is never rewritten during inference
     html = ['<!DOCTYPE html>',
             '<html>',
             '<head>',
@@ -153,6 +160,10 @@ def get_simple_navigation(data, messages=None):
             '    table { border-collapse: collapse; margin-bottom: 20px; }',
             '    td { padding-right: 24px; padding-bottom: 8px; }',
             '    a { text-decoration: none; }',
+            '    td.cell { border: 1px solid black; padding: 8px; text-align: left; font-size: 8px; }',
+            '    td.message { white-space: pre-wrap; vertical-align: top; }',
+            '    td.message div { max-height: 200px; overflow: auto; }',
+            '    td.link { text-align: center; font-size: inherit; }',
             '  </style>',
             '</head>',
             '<body>',
@@ -170,6 +181,24 @@ def get_simple_navigation(data, messages=None):
             '        tr.style.display = show ? "" : "none";',
             '      });',
             '    }',
+            '    function loadMessages(id, contents) {',
+            '      contents.forEach(function(content, i){',
+            '        var div = document.getElementById("msg-" + id + "-" + i);',
+            '        if (div) div.textContent = content;',
+            '      });',
+            '    }',
+            '    var observer = new IntersectionObserver(function(entries){',
+            '      entries.forEach(function(entry){',
+            '        if (!entry.isIntersecting) return;',
+            '        observer.unobserve(entry.target);',
+            '        var script = document.createElement("script");',
+            f'        script.src = "{NAVIGATION_FRAGMENT_DIR}/" + encodeURIComponent(entry.target.dataset.id) + ".js?" + Date.now();',
+            '        document.body.appendChild(script);',
+            '      });',
+            '    }, {rootMargin: "500px"});',
+            '    document.addEventListener("DOMContentLoaded", function(){',
+            '      document.querySelectorAll("table[data-id]").forEach(function(t){ observer.observe(t); });',
+            '    });',
             '  </script>']
 
     # Loop to build tables
@@ -177,14 +206,14 @@ def get_simple_navigation(data, messages=None):
         dir_name = d['id'].replace('.json', ".html")
         html.append(f'  <h2>{dir_name}</h2>')
         html.append(f"<p>{d['summary']['purpose']}</p>")
-        html.append('  <table style="border-collapse: collapse;">')
+        html.append(f'  <table style="border-collapse: collapse;" data-id="{d["id"]}">')
 
         # Row 1: Instructions
         html.append('    <tr class="row1">')
         for i in range(N_TURNS_PER_DATA):
             popup_text = d['cases'][i]['instructions']
             html.append(
-                f'<td style="border: 1px solid black; padding: 8px; text-align: left; font-size: 8px;">{popup_text}</td>')
+                f'<td class="cell">{popup_text}</td>')
         html.append('    </tr>')
 
         # Row 2: Type
@@ -192,18 +221,14 @@ def get_simple_navigation(data, messages=None):
         for i in range(N_TURNS_PER_DATA):
             popup_text = 'type=' + d['cases'][i]['type']
             html.append(
-                f'<td style="border: 1px solid black; padding: 8px; text-align: left; font-size: 8px;">{popup_text}</td>')
+                f'<td class="cell">{popup_text}</td>')
         html.append('    </tr>')
 
-        # Row 3: Message content (assistant replies)
+        # Row 3: Message content (assistant replies), filled in by `loadMessages`
         html.append('    <tr class="row3">')
         for i in range(N_TURNS_PER_DATA):
-            if messages is not None and len(messages.get(d["id"], [])) > 2 * i + 1:
-                popup_text = messages[d["id"]][2 * i + 1]["content"]
-            else:
-                popup_text = "-"
             html.append(
-                f'<td style="border: 1px solid black; padding: 8px; text-align: left; font-size: 8px;">{popup_text}</td>')
+                f'<td class="cell message"><div id="msg-{d["id"]}-{i}">-</div></td>')
         html.append('    </tr>')
 
         # Row 4: Test conditions
@@ -211,7 +236,7 @@ def get_simple_navigation(data, messages=None):
         for i in range(N_TURNS_PER_DATA):
             popup_text = '<br>'.join([x['condition'] for x in d['cases'][i]['test_conditions']])
             html.append(
-                f'<td style="border: 1px solid black; padding: 8px; text-align: left; font-size: 8px;">{popup_text}</td>')
+                f'<td class="cell">{popup_text}</td>')
         html.append('    </tr>')
 
         # Row 5: Links
@@ -219,7 +244,7 @@ def get_simple_navigation(data, messages=None):
         for i in range(N_TURNS_PER_DATA):
             path = f't.{i}/{dir_name}/index.html'
             html.append(
-                f'      <td style="border: 1px solid black; padding: 8px; text-align: center;"><a href="{path}">t.{i}</a></td>')
+                f'      <td class="cell link"><a href="{path}">t.{i}</a></td>')
         html.append('    </tr>')
 
         html.append('  </table>')
@@ -230,6 +255,23 @@ def get_simple_navigation(data, messages=None):
     return '\n'.join(html)
 
 
+def dump_navigation_fragment(out_dirname, data_id, messages):
+    # assistant replies of one dialogue, as a script calling `loadMessages` (plain JSON can't be loaded from file://)
+    os.makedirs(os.path.join(out_dirname, NAVIGATION_FRAGMENT_DIR), exist_ok=True)
+    contents = [m['content'] for m in messages if m['role'] == 'assistant']
+    fname = os.path.join(out_dirname, NAVIGATION_FRAGMENT_DIR, data_id + '.js')
+    with open(fname + '.tmp', 'w') as f:
+        f.write('loadMessages({}, {});\n'.format(json.dumps(data_id), json.dumps(contents)))
+    os.replace(fname + '.tmp', fname)
+
+
+def dump_navigation(out_dirname, data, messages_all):
+    with open(os.path.join(out_dirname, "navigation.html"), "w") as f:
+        f.write(get_simple_navigation(data))
+    for data_id, messages in messages_all.items():
+        dump_navigation_fragment(out_dirname, data_id, messages)
+
+
 def main_(args):
     os.makedirs(args.out_dirname, exist_ok=True)
 
@@ -242,30 +284,28 @@ def main_(args):
         print("Load existing messages:", messages_fname)
         messages_all = load_messages(messages_fname)
         total = sum([N_TURNS_PER_DATA - n_turns(messages_all.get(d['id'])) for d in data])
-    with open(os.path.join(args.out_dirname, "navigation.html"), "w") as f:
-        f.write(get_simple_navigation(data, messages_all))
+    dump_navigation(args.out_dirname, data, messages_all)
 
     finished_all = {d['id']: n_turns(messages_all.get(d['id'])) == N_TURNS_PER_DATA for d in data}
     pbar = tqdm.tqdm(total=total)
     with ProcessPoolExecutor(max_workers=args.num_workers) as exe:
         # map each future -> its (x,i) so we know how to chain
-        future_to_args = [exe.submit(main_func, d, args, messages_all.get(d['id'], []))
+        future_to_args = [exe.submit(main_func, d['id'], args, messages_all.get(d['id'], []))
                           for d in data if not finished_all[d['id']]]
         while not all(finished_all.values()):
             # wait for the next future to complete
             fut = next(as_completed(future_to_args))
-            d, messages, finished = fut.result()
+            data_id, messages, finished = fut.result()
+            d = get_frontalk_dataset()[data_id]
             dump_messages(messages_fname, d['id'], messages_all.get(d['id']), messages)
             messages_all[d['id']] = messages
             finished_all[d['id']] = finished
             # remove the completed future
             future_to_args.remove(fut)
             if not finished:
-                future_to_args.append(exe.submit(main_func, d, args, messages_all[d['id']]))
+                future_to_args.append(exe.submit(main_func, d['id'], args, messages_all[d['id']]))
+            dump_navigation_fragment(args.out_dirname, d['id'], messages)  # <- only this dialogue changed
             pbar.update()
-            if pbar.n % 20 == 0:
-                with open(os.path.join(args.out_dirname, "navigation.html"), "w") as f:
-                    f.write(get_simple_navigation(data, messages_all))
 
 
 def main():
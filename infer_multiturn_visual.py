@@ -9,8 +9,8 @@ import tqdm
 
 from draw.main import draw
 from utils import (
-    parse_files, dump_files, load_frontalk_dataset, encode_pil_image, n_turns, load_messages, dump_messages,
-    request_with_truncation,
+    parse_files, dump_files, load_frontalk_dataset, get_frontalk_dataset, store_image, n_turns, load_messages,
+    dump_messages, request_with_truncation,
 )
 
 PROMPT = """Write a website based on the instructions below. Requirements:
@@ -37,11 +37,17 @@ PROMPTS_BY_ASPECT = {
 N_TURNS_PER_DATA = 10
 
 
-def main_func(data, args, messages):
+def get_image_store_dir(args):
+    return os.path.abspath(os.path.join(args.out_dirname, 'images'))
+
+
+def main_func(data_id, args, messages):
+    data = get_frontalk_dataset()[data_id]  # <- tasks only carry the id, the record is read in the worker
     request_kwargs = {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
                       'local_openai_port': args.local_openai_port}
     if args.max_tokens is not None:
         request_kwargs['max_tokens'] = args.max_tokens
+    request_kwargs['image_root'] = os.path.abspath(args.out_dirname)  # <- image references are relative to it
     drawer_kwargs = dict(model=args.drawer_model)
 
     if len(messages) == 0:  # initialize message
@@ -72,7 +78,7 @@ def main_func(data, args, messages):
     if image is not None:
         image.save(os.path.join(draw_out_dirname, f'{i}.png'))
         messages[-1]['content'].append({"type": "image_url", "image_url": {
-            "url": "data:image/png;base64,{}".format(encode_pil_image(image))
+            "url": store_image(image, get_image_store_dir(args), root=args.out_dirname)  # <- expanded when requesting
         }})
 
     # iteratively request, until NOT overlength
@@ -89,7 +95,7 @@ def main_func(data, args, messages):
     files = parse_files(response, out_dirname_)
     dump_files(files, out_dirname_)
 
-    return data, messages, i == N_TURNS_PER_DATA - 1
+    return data_id, messages, i == N_TURNS_PER_DATA - 1
 
 
 def get_simple_navigation(data):
@@ -220,19 +226,20 @@ def main_(args):
     pbar = tqdm.tqdm(total=total)
     with ProcessPoolExecutor(max_workers=args.num_workers) as exe:
         # map each future -> its (x,i) so we know how to chain
-        future_to_args = [exe.submit(main_func, d, args, messages_all.get(d['id'], []))
+        future_to_args = [exe.submit(main_func, d['id'], args, messages_all.get(d['id'], []))
                           for d in data if not finished_all[d['id']]]
         while not all(finished_all.values()):
             # wait for the next future to complete
             fut = next(as_completed(future_to_args))
-            d, messages, finished = fut.result()
+            data_id, messages, finished = fut.result()
+            d = get_frontalk_dataset()[data_id]
             dump_messages(messages_fname, d['id'], messages_all.get(d['id']), messages)
             messages_all[d['id']] = messages
             finished_all[d['id']] = finished
             # remove the completed future
             future_to_args.remove(fut)
             if not finished:
-                future_to_args.append(exe.submit(main_func, d, args, messages_all[d['id']]))
+                future_to_args.append(exe.submit(main_func, d['id'], args, messages_all[d['id']]))
             pbar.update()
 
 
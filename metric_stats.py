@@ -0,0 +1,98 @@
+import argparse
+import os
+
+import numpy as np
+import tabulate
+
+from evaluate_all import (
+    N_TURNS_PER_DATA, N_BOOTSTRAP, METRICS, augment_type_in_metrics, metrics_to_array, per_dialogue_counts,
+    metrics_from_counts, cluster_bootstrap_weights, confidence_intervals,
+)
+from utils import load_messages, load_frontalk_dataset
+
+# Confidence intervals and paired significance tests for pass rate and forgetting, from the results written by
+# evaluate_all.py. Dialogues are the unit of resampling (cluster bootstrap, see `cluster_bootstrap_weights`).
+
+
+def load_run(dirname, openai_model, data):
+    # per-turn results of evaluate_all.py in `dirname`, None for turns that were not evaluated
+    results_all = []
+    for t in range(N_TURNS_PER_DATA):
+        fname = os.path.join(dirname, f't.{t}', 'evaluation_results.{}.jsonl'.format(openai_model.replace('/', '__')))
+        results_all.append(augment_type_in_metrics(load_messages(fname), data) if os.path.exists(fname) else None)
+    return results_all
+
+
+def runs_to_arrays(runs):
+    """`metrics_to_array` of several runs, aligned on the same dialogues and with the same shape."""
+    ids = sorted({k for results_all in runs for metrics in results_all if metrics for k in metrics})
+    arrays = [metrics_to_array(results_all, ids=ids) for results_all in runs]
+    shape = tuple(max(acc.shape[k] for acc, _, _ in arrays) for k in range(4))
+
+    def pad(x, target, fill=0):
+        return np.pad(x, [(0, n - m) for n, m in zip(target, x.shape)], constant_values=fill)
+
+    arrays = [(pad(acc, shape), pad(mask, shape), pad(case_type, shape[1:3], fill=-1))
+              for acc, mask, case_type in arrays]
+    case_type = arrays[0][2]
+    for _, _, ct in arrays[1:]:
+        case_type = np.where(case_type >= 0, case_type, ct)
+    return [(acc, mask) for acc, mask, _ in arrays], case_type
+
+
+def paired_comparison(run_a, run_b, case_type, n_bootstrap=N_BOOTSTRAP, alpha=0.05, seed=0):
+    """metric -> (A, B, B - A, low, high, p) on the test cases evaluated in both runs.
+
+    Both runs are resampled with the same dialogues, so the differences keep the pairing. `p` is the two-sided
+    bootstrap p-value of B - A = 0."""
+    common = run_a[1] & run_b[1]
+    counts_a = per_dialogue_counts(run_a[0], common)
+    counts_b = per_dialogue_counts(run_b[0], common)
+    weights = cluster_bootstrap_weights(len(case_type), n_bootstrap, seed)
+    point_a, point_b = metrics_from_counts(counts_a, case_type), metrics_from_counts(counts_b, case_type)
+    samples_a = metrics_from_counts(counts_a, case_type, weights)
+    samples_b = metrics_from_counts(counts_b, case_type, weights)
+    ret = {}
+    for _, key in METRICS:
+        if np.isnan(point_a[key][0]) or np.isnan(point_b[key][0]):
+            continue
+        diff = samples_b[key] - samples_a[key]
+        diff = diff[~np.isnan(diff)]
+        low, high = np.percentile(diff, [alpha / 2 * 100, (1 - alpha / 2) * 100])
+        p = min(1., 2 * min(np.mean(diff <= 0), np.mean(diff >= 0)))
+        ret[key] = (point_a[key][0], point_b[key][0], point_b[key][0] - point_a[key][0], low, high, p)
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dirs", nargs="+", help="out_dirname of one run (CIs), or of two runs A and B (paired test)")
+    parser.add_argument("--openai_model", default="gpt-4o", help="evaluator model")
+    parser.add_argument("--n_bootstrap", default=N_BOOTSTRAP, type=int)
+    parser.add_argument("--alpha", default=0.05, type=float)
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+    assert len(args.dirs) in (1, 2)
+
+    data = load_frontalk_dataset()
+    runs, case_type = runs_to_arrays([load_run(dirname, args.openai_model, data) for dirname in args.dirs])
+    level = int(round((1 - args.alpha) * 100))
+    print("{:d} dialogues, {:d} bootstrap resamplings of dialogues".format(len(case_type), args.n_bootstrap))
+
+    if len(runs) == 1:
+        ret = confidence_intervals(*runs[0], case_type, args.n_bootstrap, args.alpha, args.seed)
+        table = [[name, "{:.2f}".format(ret[key][0] * 100), "[{:.2f}, {:.2f}]".format(*np.array(ret[key][1:]) * 100)]
+                 for name, key in METRICS if key in ret]
+        print(tabulate.tabulate(table, headers=['Metric', 'Estimate', f'{level}% CI'], disable_numparse=True))
+    else:
+        ret = paired_comparison(runs[0], runs[1], case_type, args.n_bootstrap, args.alpha, args.seed)
+        print("A = {}\nB = {}\nOn test cases evaluated in both runs:".format(*args.dirs))
+        table = [[name] + ["{:.2f}".format(x * 100) for x in ret[key][:3]] +
+                 ["[{:.2f}, {:.2f}]".format(ret[key][3] * 100, ret[key][4] * 100), "{:.4f}".format(ret[key][5])]
+                 for name, key in METRICS if key in ret]
+        print(tabulate.tabulate(table, headers=['Metric', 'A', 'B', 'B - A', f'{level}% CI of B - A', 'p'],
+                                disable_numparse=True))
+
+
+if __name__ == "__main__":
+    main()
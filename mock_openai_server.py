@@ -0,0 +1,223 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local OpenAI-compatible server (POST /v1/chat/completions) returning canned responses, to benchmark the orchestration
+# of all entry points without calling a real model. The responses are valid for each kind of request made in this repo
+# (website generation, user simulation, drawing, pass-rate / usability / ACECoder agents, usability comparison), so
+# every code path runs end to end. GET /stats returns request counts and the peak number of concurrent requests.
+
+WEBSITE_TEMPLATE = """## index.html
+```html
+<!DOCTYPE html>
+<html>
+<head><meta charset="UTF-8"><title>Mock website</title></head>
+<body>
+<h1>Mock website</h1>
+<nav>{links}</nav>
+<p>{text}</p>
+</body>
+</html>
+```
+{pages}"""
+
+PAGE_TEMPLATE = """
+## {fname}
+```html
+<!DOCTYPE html>
+<html><head><meta charset="UTF-8"><title>{name}</title></head>
+<body><h1>{name}</h1><a href="index.html">Home</a></body></html>
+```
+"""
+
+DRAWING_CODE = """```python
+fig, ax = plt.subplots(figsize=(8, 6))
+ax.set_xlim(0, 1)
+ax.set_ylim(0, 1)
+ax.text(0.5, 0.5, "Mock drawing", ha="center", va="center")
+```"""
+
+
+def message_text(msg):
+    if isinstance(msg['content'], str):
+        return msg['content']
+    return '\n'.join(item.get('text', '') for item in msg['content'] if item.get('type') == 'text')
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class MockModel:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.lock = threading.RLock()
+        self.stats = {'requests': 0, 'errors': 0, 'overlength': 0, 'in_flight': 0, 'max_in_flight': 0, 'kinds': {}}
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def classify(self, messages):
+        first = message_text(messages[0])
+        if first.startswith("Write a website based on the instructions below"):
+            return 'website'
+        if first.startswith("You are provided with instructions to"):
+            return 'user_simulator'
+        if first.startswith("You are an expert drawing agent"):
+            return 'drawing'
+        if 'Trajectory A' in first:
+            return 'usability_comparison'
+        if first.startswith("Your task is to evaluate the **usability**"):
+            return 'usability_agent'
+        if first.startswith("You are an expert evaluator of built websites") and 'set of instructions' in first:
+            return 'acecoder_agent'
+        if first.startswith("You are an expert evaluator of built websites"):
+            return 'pass_rate_agent'
+        return 'other'
+
+    def respond(self, kind, messages):
+        last = message_text(messages[-1])
+        if kind == 'website':
+            instructions = '\n'.join(message_text(m) for m in messages if m['role'] == 'user')
+            names = list(dict.fromkeys(re.findall(r'["“]([^"”]{2,40})["”]', instructions)))[:10]
+            fnames = [re.sub(r'[^a-z0-9]+', '-', n.lower()).strip('-') + '.html' for n in names]
+            return WEBSITE_TEMPLATE.format(
+                links=' '.join(f'<a href="{f}">{n}</a>' for f, n in zip(fnames, names)),
+                text=instructions[-500:].replace('<', ' '),
+                pages=''.join(PAGE_TEMPLATE.format(fname=f, name=n) for f, n in zip(fnames, names)),
+            )
+        if kind == 'user_simulator':
+            instructions = last.split("# Instructions to Refine")[-1].split("# Code for Existing Website")[0].strip()
+            return "**Response:** " + instructions
+        if kind == 'drawing':
+            return "YES" if len(messages) > 1 else DRAWING_CODE
+        if kind == 'usability_comparison':
+            return "Both trajectories are similar.\n\nVERDICT: " + self.rng.choice(['WIN', 'LOSE', 'TIE'])
+        if kind == 'usability_agent':
+            if "You've reached the step limit" in last:
+                return "The website was easy to explore."
+            return "Thought: Let me look further down the page.\nAction: Scroll [WINDOW]; down"
+        if kind in ('pass_rate_agent', 'acecoder_agent'):
+            n_steps = sum(m['role'] == 'assistant' for m in messages)
+            if n_steps < self.args.agent_steps and "You've reached the step limit" not in last:
+                return "Thought: Let me look further down the page.\nAction: Scroll [WINDOW]; down"
+            verdict = 'PASS' if self.random() < self.args.pass_rate else 'FAIL'
+            return f"Thought: The website was checked.\nAction: ANSWER; {verdict}"
+        return "OK"
+
+    def latency(self, completion_tokens):
+        with self.lock:
+            latency = self.args.latency * self.rng.lognormvariate(0, self.args.latency_sigma) \
+                if self.args.latency > 0 else 0.
+        if self.args.tokens_per_second > 0:
+            latency += completion_tokens / self.args.tokens_per_second
+        return latency
+
+
+def make_handler(model: MockModel):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, code, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/').endswith('/stats'):
+                with model.lock:
+                    self.send_json(200, model.stats)
+            elif self.path.rstrip('/').endswith('/models'):
+                self.send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+            else:
+                self.send_json(404, {'error': {'message': 'not found'}})
+
+        def do_POST(self):
+            if not self.path.rstrip('/').endswith('/chat/completions'):
+                self.send_json(404, {'error': {'message': 'not found'}})
+                return
+            req = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            messages = req['messages']
+            kind = model.classify(messages)
+            with model.lock:
+                model.stats['requests'] += 1
+                model.stats['kinds'][kind] = model.stats['kinds'].get(kind, 0) + 1
+                model.stats['in_flight'] += 1
+                model.stats['max_in_flight'] = max(model.stats['max_in_flight'], model.stats['in_flight'])
+            try:
+                u = model.random()
+                if u < model.args.error_rate:
+                    with model.lock:
+                        model.stats['errors'] += 1
+                    time.sleep(model.latency(0))
+                    self.send_json(500, {'error': {'message': 'Injected server error', 'type': 'server_error'}})
+                    return
+                if u < model.args.error_rate + model.args.overlength_rate:
+                    with model.lock:
+                        model.stats['overlength'] += 1
+                    self.send_json(400, {'error': {
+                        'message': 'Please reduce the length of the messages or completion.',
+                        'type': 'invalid_request_error',
+                    }})
+                    return
+
+                with model.lock:
+                    content = model.respond(kind, messages)
+                prompt_tokens = sum(estimate_tokens(message_text(m)) for m in messages)
+                completion_tokens = estimate_tokens(content)
+                time.sleep(model.latency(completion_tokens))
+                self.send_json(200, {
+                    'id': 'chatcmpl-' + uuid.uuid4().hex, 'object': 'chat.completion', 'created': int(time.time()),
+                    'model': req.get('model', 'mock'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                              'total_tokens': prompt_tokens + completion_tokens},
+                })
+            finally:
+                with model.lock:
+                    model.stats['in_flight'] -= 1
+
+    return Handler
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", default=8000, type=int)
+    parser.add_argument("--latency", default=1.0, type=float, help="median latency per request (s)")
+    parser.add_argument("--latency_sigma", default=0.5, type=float, help="sigma of the log-normal latency")
+    parser.add_argument("--tokens_per_second", default=0., type=float,
+                        help="output throughput, adds completion_tokens / tokens_per_second to the latency")
+    parser.add_argument("--error_rate", default=0., type=float, help="fraction of requests answered with HTTP 500")
+    parser.add_argument("--overlength_rate", default=0., type=float,
+                        help="fraction of requests answered with a context-length error")
+    parser.add_argument("--pass_rate", default=0.5, type=float, help="fraction of PASS verdicts of evaluator agents")
+    parser.add_argument("--agent_steps", default=2, type=int, help="steps of evaluator agents before answering")
+    parser.add_argument("--seed", default=0, type=int)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(MockModel(args)))
+    server.daemon_threads = True
+    print("Mock OpenAI server at http://localhost:{}/v1".format(args.port), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
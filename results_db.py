@@ -0,0 +1,163 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+
+import numpy as np
+import tabulate
+
+from evaluate_all import N_TURNS_PER_DATA, metrics_to_array, per_dialogue_counts, metrics_from_counts
+from utils import load_messages, load_frontalk_dataset
+
+# Local store of evaluation outcomes of many runs (output dirs of infer_*.py), to compare them without re-parsing and
+# re-aggregating each dir. Pass-rate results are indexed by (run, turn, dialogue, instruction, condition, evaluator),
+# usability results by (run, dialogue, evaluator). Metrics are computed with the same code as evaluate_all.py.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pass_rate (
+    run TEXT, turn INTEGER, dialogue TEXT, inst INTEGER, cond INTEGER, evaluator TEXT, type TEXT, acc INTEGER,
+    PRIMARY KEY (run, turn, dialogue, inst, cond, evaluator)
+);
+CREATE TABLE IF NOT EXISTS usability (
+    run TEXT, dialogue TEXT, evaluator TEXT, score_1 REAL, score_2 REAL,
+    PRIMARY KEY (run, dialogue, evaluator)
+);
+CREATE INDEX IF NOT EXISTS pass_rate_run ON pass_rate (run, evaluator);
+"""
+
+
+def connect(db_fname):
+    conn = sqlite3.connect(db_fname)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def evaluator_of(fname, prefix):
+    # evaluation_results.<model>.jsonl -> <model>, as written by evaluate_all.py / usability.py
+    return os.path.basename(fname)[len(prefix):-len('.jsonl')].replace('__', '/')
+
+
+def ingest_run(conn, run_dir, run=None, data=None):
+    """Insert (or replace) all results found in `run_dir` under the name `run` (default: name of `run_dir`).
+
+    Returns the number of pass-rate and usability rows."""
+    if run is None:
+        run = os.path.basename(os.path.normpath(run_dir))
+    if data is None:
+        data = load_frontalk_dataset()
+    types = {d['id']: [c['type'] for c in d['cases']] for d in data}
+
+    rows = []
+    for t in range(N_TURNS_PER_DATA):
+        for fname in glob.glob(os.path.join(run_dir, f't.{t}', 'evaluation_results.*.jsonl')):
+            evaluator = evaluator_of(fname, 'evaluation_results.')
+            for k, m in load_messages(fname).items():
+                for i, j, acc in m:
+                    rows.append((run, t, k, i, j, evaluator, types[k][i], int(acc)))
+    usability_rows = []
+    for fname in glob.glob(os.path.join(run_dir, f't.{N_TURNS_PER_DATA - 1}', 'usability_comparison_results.*.jsonl')):
+        evaluator = evaluator_of(fname, 'usability_comparison_results.')
+        with open(fname) as f:
+            for line in f:
+                k, v1, v2 = json.loads(line)
+                usability_rows.append((run, k, evaluator, v1, v2))
+
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO pass_rate VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT OR REPLACE INTO usability VALUES (?, ?, ?, ?, ?)", usability_rows)
+    return len(rows), len(usability_rows)
+
+
+def load_pass_rate(conn, runs=None, evaluators=None):
+    # (run, evaluator) -> per-turn results as in evaluate_all.py (id -> [[i, j, acc, type], ...], None if not evaluated),
+    # optionally restricted to some runs / evaluators
+    query = "SELECT run, evaluator, turn, dialogue, inst, cond, acc, type FROM pass_rate"
+    conditions, params = [], []
+    for col, values in [('run', runs), ('evaluator', evaluators)]:
+        if values:
+            conditions.append("{} IN ({})".format(col, ', '.join('?' * len(values))))
+            params += list(values)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    results = {}
+    for run, evaluator, turn, dialogue, inst, cond, acc, type_ in conn.execute(query, params):
+        results_all = results.setdefault((run, evaluator), [None] * N_TURNS_PER_DATA)
+        if results_all[turn] is None:
+            results_all[turn] = {}
+        results_all[turn].setdefault(dialogue, []).append([inst, cond, acc, type_])
+    return results
+
+
+def aggregate_pass_rate(results_all):
+    """Accuracy (last turn, all instructions), per type, per instruction and forgetting of one (run, evaluator), with
+    the same code as evaluate_all.py and metric_stats.py. NaN where there are no results."""
+    acc, mask, case_type = metrics_to_array(results_all)
+    counts = per_dialogue_counts(acc, mask)
+    ret = {k: v[0] for k, v in metrics_from_counts(counts, case_type).items()}
+    ret['total'] = counts['last_total'].sum()
+    return ret
+
+
+def aggregate_usability(conn, runs=None):
+    # (run, evaluator) -> win rate against the reference, averaged over both orderings
+    rows = conn.execute("SELECT run, evaluator, score_1, score_2 FROM usability").fetchall()
+    ret = {}
+    for run, evaluator, v1, v2 in rows:
+        if runs and run not in runs:
+            continue
+        ret.setdefault((run, evaluator), []).append((v1 + v2) / 2)
+    return {k: float(np.mean(v)) for k, v in ret.items()}
+
+
+def report(conn, runs=None, evaluators=None, per_inst=False):
+    results = load_pass_rate(conn, runs, evaluators)
+    if len(results) == 0:
+        print("No results")
+        return
+    usability = aggregate_usability(conn, runs)
+
+    def fmt(x):
+        return '-' if np.isnan(x) else '{:.2f}'.format(x * 100)
+
+    headers = ['Run', 'Evaluator', '#', 'Acc.', 'Function', 'Design', 'Forgetting', 'F. Function', 'F. Design',
+               'Usability'] + (['Inst. {:d}'.format(i + 1) for i in range(N_TURNS_PER_DATA)] if per_inst else [])
+    table = []
+    for run, evaluator in sorted(results):
+        agg = aggregate_pass_rate(results[(run, evaluator)])
+        line = [run, evaluator, int(agg['total'])] + [fmt(agg[k]) for k in [
+            'acc', 'acc_function', 'acc_design', 'forgetting', 'forgetting_function', 'forgetting_design'
+        ]] + [fmt(usability[(run, evaluator)]) if (run, evaluator) in usability else '-']
+        if per_inst:
+            line += [fmt(x) for x in agg['acc_per_inst'][:N_TURNS_PER_DATA]]
+        table.append(line)
+    print(tabulate.tabulate(table, headers=headers))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default="results.sqlite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    parser_ingest = subparsers.add_parser("ingest", help="add the evaluation results of output dirs of infer_*.py")
+    parser_ingest.add_argument("dirs", nargs="+")
+    parser_ingest.add_argument("--name", default=None, nargs="+", help="run names; default: names of the dirs")
+    parser_report = subparsers.add_parser("report", help="accuracy, forgetting and usability of each run")
+    parser_report.add_argument("--runs", default=None, nargs="+")
+    parser_report.add_argument("--evaluators", default=None, nargs="+")
+    parser_report.add_argument("--per_inst", default=False, action="store_true")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    if args.command == 'ingest':
+        assert args.name is None or len(args.name) == len(args.dirs)
+        data = load_frontalk_dataset()
+        for idx, dirname in enumerate(args.dirs):
+            n, n_usability = ingest_run(conn, dirname, None if args.name is None else args.name[idx], data=data)
+            print("{}: {:d} pass-rate and {:d} usability results".format(dirname, n, n_usability))
+    else:
+        report(conn, args.runs, args.evaluators, per_inst=args.per_inst)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,30 +4,42 @@ import multiprocessing
 import os
 import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 
 import numpy as np
 import tqdm
 
-from utils import load_frontalk_dataset
-from webvoyager.run_evaluate import run_evaluate_usability, compare_usability
+from utils import load_frontalk_dataset, get_frontalk_dataset
+from webvoyager.run_evaluate import run_evaluate_usability, compare_usability, prepare_trajectory
 
 
-def main_func(data, args):
-    request_kwargs = {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
-                      'local_openai_port': args.local_openai_port}
+def get_request_kwargs(args):
+    return {'model': args.openai_model, 'openai_api_key': args.local_openai_key,
+            'local_openai_port': args.local_openai_port}
+
+
+def explore_func(data_id, args):
+    # browser stage: explore the website, and prepare the trajectory for the comparisons
+    data = get_frontalk_dataset()[data_id]  # <- tasks only carry the id, the record is read in the worker
+    request_kwargs = get_request_kwargs(args)
 
     filename = os.path.abspath(os.path.join(args.dir, data['id'], 'index.html'))
     task_dir = os.path.join(args.dir, data['id'], 'usability_compare_tmpdir', args.openai_model.replace('/', '__'))
     if os.path.exists(task_dir):
         shutil.rmtree(task_dir, ignore_errors=True)
-    run_evaluate_usability('file://' + filename, data['summary']['purpose'], request_kwargs, task_dir=task_dir)
+    run_evaluate_usability('file://' + filename, data['summary']['purpose'], request_kwargs, task_dir=task_dir,
+                           accessibility_tree=args.accessibility_tree)
+
+    return data_id, prepare_trajectory(task_dir)  # <- shared by both orderings
 
-    ref_dir = os.path.join(REF, data['id'], 'usability_compare_tmpdir')
-    msg_1, score_1 = compare_usability(task_dir, ref_dir, request_kwargs)  # 0, 0.5, 1
-    msg_2, score_2 = compare_usability(ref_dir, task_dir, request_kwargs)
-    score_2 = (1 - score_2) if score_2 is not None else None
-    return data, (msg_1, score_1), (msg_2, score_2)
+
+def compare_func(trajA, trajB, request_kwargs, flip=False):
+    # LLM stage: one ordering of the comparison, scored from the point of view of the evaluated website
+    msg, score = compare_usability(trajA, trajB, request_kwargs)  # 0, 0.5, 1
+    if flip and score is not None:
+        score = 1 - score
+    return msg, score
 
 
 def main_(args):
@@ -54,11 +66,24 @@ def main_(args):
                 messages[k] = (m1, m2)
     assert len(messages) == len(metrics)
 
+    refs = {}
     while True:
         data_todo = [d for d in data if d['id'] not in metrics]
-        with multiprocessing.Pool(args.num_workers) as p:
-            pbar = tqdm.tqdm(p.imap(partial(main_func, args=args), data_todo), total=len(data_todo))
-            for d, (m1, v1), (m2, v2) in pbar:
+        for d in data_todo:  # <- cached in the reference dirs, so only built once across runs and systems
+            if d['id'] not in refs:
+                refs[d['id']] = prepare_trajectory(os.path.join(REF, d['id'], 'usability_compare_tmpdir'))
+        # pipelined: websites are explored by `num_workers` processes (browsers), while the comparisons, which only
+        # wait for the LLM, run in `num_compare_workers` threads of this process, both orderings concurrently
+        pbar = tqdm.tqdm(total=len(data_todo))
+        pending = []
+
+        def collect(wait):
+            for d, f1, f2 in pending[:]:
+                if not wait and not (f1.done() and f2.done()):
+                    continue
+                pending.remove((d, f1, f2))
+                (m1, v1), (m2, v2) = f1.result(), f2.result()
+                pbar.update()
                 if v1 is not None and v2 is not None:
                     metrics[d['id']] = (v1, v2)
                     pbar.set_postfix(winrate=np.mean(list(metrics.values())))
@@ -66,6 +91,18 @@ def main_(args):
                         f.write(json.dumps([d['id'], v1, v2]) + '\n')
                     with open(messages_fname, 'a') as f:
                         f.write(json.dumps([d['id'], m1, m2]) + '\n')
+
+        request_kwargs = get_request_kwargs(args)
+        num_compare_workers = args.num_compare_workers or 2 * args.num_workers
+        with multiprocessing.Pool(args.num_workers) as p, ThreadPoolExecutor(num_compare_workers) as compare_exe:
+            for data_id, traj in p.imap_unordered(partial(explore_func, args=args), [d['id'] for d in data_todo]):
+                d = get_frontalk_dataset()[data_id]
+                ref = refs[d['id']]
+                pending.append((d, compare_exe.submit(compare_func, traj, ref, request_kwargs),
+                                compare_exe.submit(compare_func, ref, traj, request_kwargs, flip=True)))
+                collect(wait=False)
+            collect(wait=True)
+        pbar.close()
         if len(metrics) == len(data):
             break
         print("Not finished! Only finished {:d} out of {:d}. Try again".format(len(metrics), len(data)))
@@ -84,8 +121,12 @@ def main(args=None):
         parser.add_argument("--local_openai_port", default=None)
         parser.add_argument("--local_openai_key", default=None)
         parser.add_argument("--openai_model", default=None)
-        parser.add_argument("--num_workers", default=32, type=int)
+        parser.add_argument("--num_workers", default=32, type=int, help="websites explored (browsers) at a time")
+        parser.add_argument("--num_compare_workers", default=None, type=int,
+                            help="usability comparisons (LLM calls) at a time; default: 2 * num_workers")
         parser.add_argument("--keep_retrying", default=False, action="store_true")
+        parser.add_argument("--accessibility_tree", default="off", choices=["off", "sync", "background"],
+                            help="save the accessibility tree of each step for archival (not used by the evaluator)")
         args = parser.parse_args()
 
     if args.keep_retrying:
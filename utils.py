@@ -2,13 +2,18 @@ import base64
 import copy
 import hashlib
 import json
+import mmap
 import os
 import re
 import time
 from io import BytesIO
 
 from PIL import Image
-from openai import OpenAI
+
+from webvoyager.lazy import lazy_import
+from webvoyager.tracing import traced
+
+openai = lazy_import('openai')
 
 
 def parse_single_file(text):
@@ -64,10 +69,109 @@ def dump_files(files, out_dir):
             f.write(content)
 
 
+# Files that are written into a website dir by evaluation / reflection, but are not part of the website itself
+SITE_HASH_IGNORE = ('evaluation_tmpdir', 'usability_compare_tmpdir', 'reflect.json')
+
+
+def hash_site_files(dirname, ignore=SITE_HASH_IGNORE):
+    # relative path -> sha256 of each file of the website, in a deterministic order
+    ret = {}
+    for dirpath, dirnames, filenames in os.walk(dirname):
+        dirnames[:] = sorted([dn for dn in dirnames if dn not in ignore])
+        for fn in sorted(filenames):
+            if fn in ignore:
+                continue
+            path = os.path.join(dirpath, fn)
+            with open(path, 'rb') as f:
+                ret[os.path.relpath(path, dirname)] = hashlib.sha256(f.read()).digest()
+    return ret
+
+
+def hash_site_dir(dirname, ignore=SITE_HASH_IGNORE, file_hashes=None):
+    if file_hashes is None:
+        file_hashes = hash_site_files(dirname, ignore=ignore)
+    h = hashlib.sha256()
+    for relpath, digest in file_hashes.items():
+        h.update(relpath.encode() + b'\0')
+        h.update(digest)
+    return h.hexdigest()
+
+
+DATASET_FNAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data.jsonl')
+DATASET_ID_RE = re.compile(rb'\{\s*"id"\s*:\s*"([^"\\]*)"')
+
+
+class FronTalkDataset:
+    """Lazy, indexed access to the dataset (one JSON record per line).
+
+    Opening only scans the memory-mapped file for the id at the start of each line (id -> byte range); records are
+    parsed when accessed, and cached. Pickling only carries the file name, so a pool worker re-opens the file itself.
+    """
+
+    def __init__(self, fname=DATASET_FNAME):
+        self.fname = fname
+        self._mmap = None
+        self._index = None  # <- id -> (start, end) of its line, in file order
+        self._records = {}
+
+    def __getstate__(self):
+        return {'fname': self.fname}
+
+    def __setstate__(self, state):
+        self.__init__(state['fname'])
+
+    def _build_index(self):
+        with open(self.fname, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index = {}
+        start = 0
+        while start < len(self._mmap):
+            end = self._mmap.find(b'\n', start)
+            if end == -1:
+                end = len(self._mmap)
+            match = DATASET_ID_RE.match(self._mmap, start, end)
+            if match is not None:
+                self._index[match.group(1).decode()] = (start, end)
+            elif self._mmap[start:end].strip():  # <- id is not the first key: parse the whole line
+                self._index[json.loads(self._mmap[start:end])['id']] = (start, end)
+            start = end + 1
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._build_index()
+        return self._index
+
+    def ids(self):
+        return list(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, data_id):
+        return data_id in self.index
+
+    def __getitem__(self, data_id):
+        if data_id not in self._records:
+            start, end = self.index[data_id]
+            self._records[data_id] = json.loads(self._mmap[start:end])
+        return self._records[data_id]
+
+    def __iter__(self):
+        return (self[data_id] for data_id in self.index)
+
+
+DATASETS = {}  # <- fname -> FronTalkDataset, one per process
+
+
+def get_frontalk_dataset(fname=DATASET_FNAME):
+    if fname not in DATASETS:
+        DATASETS[fname] = FronTalkDataset(fname)
+    return DATASETS[fname]
+
+
 def load_frontalk_dataset():
-    with open('data.jsonl') as f:
-        data = [json.loads(line) for line in f]
-    return data
+    return list(get_frontalk_dataset())
 
 
 def encode_image(image_path):
@@ -75,6 +179,62 @@ def encode_image(image_path):
         return base64.b64encode(image_file.read()).decode("utf-8")
 
 
+def image_ref(image_path, root=None):
+    """Lightweight reference to an image file on disk, to put in messages instead of base64 (see `expand_image_refs`).
+
+    With `root`, the path is stored relative to it (`file:<relpath>`), so that saved messages stay valid when the
+    directory is moved; otherwise it is absolute (`file://<abspath>`)."""
+    if root is None:
+        return 'file://' + os.path.abspath(image_path)
+    return 'file:' + os.path.relpath(os.path.abspath(image_path), os.path.abspath(root))
+
+
+def resolve_image_ref(url, root=None):
+    # path of the image referenced by `url`, or None if `url` isn't a reference
+    if url.startswith('file://'):
+        return url[len('file://'):]
+    if url.startswith('file:'):
+        assert root is not None, "relative image reference {} needs a root".format(url)
+        return os.path.join(root, url[len('file:'):])
+    return None
+
+
+def store_image(image, store_dir, root=None):
+    """Save `image` (PIL image or base64 PNG) in a content-addressed store and return its `image_ref`."""
+    if isinstance(image, Image.Image):
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        image_data = buffered.getvalue()
+    else:
+        image_data = base64.b64decode(image)
+    fname = os.path.join(store_dir, hashlib.sha256(image_data).hexdigest() + '.png')
+    if not os.path.exists(fname):
+        os.makedirs(store_dir, exist_ok=True)
+        tmp_fname = fname + '.{}.tmp'.format(os.getpid())
+        with open(tmp_fname, 'wb') as f:
+            f.write(image_data)
+        os.replace(tmp_fname, fname)  # <- atomic: concurrent writers of the same content are fine
+    return image_ref(fname, root=root)
+
+
+def expand_image_refs(messages, image_root=None):
+    # replace image references by base64 data urls, right before sending a request. Relative references are resolved
+    # against `image_root`. `messages` isn't modified
+    ret = []
+    for m in messages:
+        if isinstance(m['content'], list) and any(
+                item['type'] == 'image_url' and item['image_url']['url'].startswith('file:') for item in m['content']
+        ):
+            m = {**m, 'content': [
+                {**item, 'image_url': {**item['image_url'], 'url': "data:image/png;base64,{}".format(
+                    encode_image(resolve_image_ref(item['image_url']['url'], image_root))
+                )}} if item['type'] == 'image_url' and item['image_url']['url'].startswith('file:') else item
+                for item in m['content']
+            ]}
+        ret.append(m)
+    return ret
+
+
 def encode_pil_image(image: Image.Image) -> str:
     buffered = BytesIO()
     image.save(buffered, format="PNG")  # or use the format of your choice (e.g., JPEG)
@@ -87,7 +247,9 @@ def decode_pil_image(encoded_str: str) -> Image.Image:
     return Image.open(buffered)
 
 
-def request_(messages, model: str, local_openai_port: int = None, openai_api_key: str = None, max_tokens: int = 10000):
+def request_(messages, model: str, local_openai_port: int = None, openai_api_key: str = None, max_tokens: int = 10000,
+             image_root: str = None):
+    messages = expand_image_refs(messages, image_root=image_root)
     if 'gemini' in model:
         from google import genai
         from google.genai.types import Content, Part
@@ -185,7 +347,7 @@ def request_(messages, model: str, local_openai_port: int = None, openai_api_key
     kwargs = dict(messages=messages, model=model)
     if max_tokens is not None:
         kwargs['max_tokens'] = max_tokens
-    client = OpenAI(api_key=openai_api_key, base_url=openai_base_url)
+    client = openai.OpenAI(api_key=openai_api_key, base_url=openai_base_url)
 
     try:
         response = client.chat.completions.create(**kwargs)
@@ -200,6 +362,7 @@ def request_(messages, model: str, local_openai_port: int = None, openai_api_key
     return response.choices[0].message.content
 
 
+@traced('llm.request')
 def request(messages, model: str, wait_if_fail: int = 60, n_retry: int = 10, **kwargs):
     for _ in range(n_retry):
         try:
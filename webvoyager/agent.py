@@ -0,0 +1,686 @@
+import glob
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from PIL import Image
+from selenium.common.exceptions import NoAlertPresentException
+from selenium.webdriver.common.action_chains import ActionChains
+from selenium.webdriver.common.by import By
+
+from utils import image_ref
+from .downloads import DownloadWatcher
+from .tracing import span, traced, bind_tracer
+from .run import (
+    get_default_driver, exec_action_click, exec_action_type, exec_action_scroll, exec_action_select
+)
+from .utils import (
+    driver_get_safe, driver_execute_script_safe, get_web_element_rect, extract_information,
+    get_webarena_accessibility_tree, print_message
+)
+
+# Shared observe -> LLM -> act loop of the web agents (pass rate evaluation, usability exploration and ACECoder
+# verification). What differs between them is expressed by an `AgentPolicy`; `AgentHooks` expose the loop's internals.
+
+ACTION_PATTERN = r'Thought:|Action:|Observation:'
+FORMAT_ERROR_MSG = "Format ERROR: Both 'Thought' and 'Action' should be included in your reply."
+ACTION_ERROR_MSG = "The action you have chosen cannot be executed. Please double-check if you have selected the wrong Numerical Label or Action or Action format. Then provide the revised Thought and Action."
+
+
+def setup_logger(folder_path):
+    # one agent.log per thread, so that sessions running concurrently in threads (e.g. ACECoder verification) don't
+    # write to or close each other's log
+    log_file_path = os.path.join(folder_path, 'agent.log')
+    thread_id = threading.get_ident()
+
+    alive = {t.ident for t in threading.enumerate()}
+
+    logger = logging.getLogger()
+    for handler in logger.handlers[:]:
+        owner = getattr(handler, 'agent_thread', thread_id)
+        if owner == thread_id or owner not in alive:  # <- also close the logs of finished threads
+            logger.removeHandler(handler)
+            handler.close()
+
+    handler = logging.FileHandler(log_file_path)
+    formatter = logging.Formatter('%(levelname)s - %(message)s')
+    handler.setFormatter(formatter)
+    handler.agent_thread = thread_id
+    handler.addFilter(lambda record: record.thread == thread_id)
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+
+def format_msg(it, init_msg, pdf_obs, alert_obs, warn_obs, web_img_url, web_text, last_message, screenshot_name=True):
+    if alert_obs:
+        web_text = "Pop-up message (already closed): {}\n{}".format(alert_obs, web_text)
+    if pdf_obs:
+        warn_obs = warn_obs + '\n' + pdf_obs
+    if warn_obs:
+        web_text = "Observation: {}\n{}".format(warn_obs, web_text)
+
+    msg = "### Textual representation\n"
+    if screenshot_name:
+        msg += f"Screenshot name: screenshot_{it}\n"
+    msg += web_text
+    if it == 1:
+        msg = (init_msg.strip() + '\n\n' + msg.strip()).strip()
+    if last_message is not None:
+        msg = msg.strip() + '\n\n' + last_message
+
+    messages = [{
+        'role': 'user',
+        'content': [
+            {'type': 'text', 'text': msg},
+            {"type": "image_url", "image_url": {"url": web_img_url}},
+        ]
+    }, ]
+    return messages
+
+
+def format_visual_msg(visuals):
+    messages = [{
+        'role': 'user',
+        'content': [
+            {'type': 'text', 'text': visuals[key]['name']},
+            {"type": "image_url", "image_url": {"url": visuals[key]['url']}},
+        ]
+    } for key in sorted(visuals.keys())]
+    return messages
+
+
+class ConversationBuffer:
+    """Message history in which only the latest `max_img_num` image-bearing user messages keep their image.
+
+    Older ones are replaced by a text-only copy as soon as the limit is exceeded, so the history is never re-walked and
+    base64 strings of old screenshots are released. Messages are never mutated in place.
+    """
+
+    def __init__(self, max_img_num, messages=()):
+        self.max_img_num = max_img_num
+        self.messages = []
+        self.image_indices = deque()  # <- positions of messages that still have an image, oldest first
+        self.extend(messages)
+
+    def append(self, msg):
+        if msg['role'] == 'user' and type(msg['content']) != str:
+            assert len(msg['content']) == 2
+            assert msg['content'][0]['type'] == 'text' and msg['content'][1]['type'] == 'image_url'
+            self.image_indices.append(len(self.messages))
+        self.messages.append(msg)
+        while len(self.image_indices) > self.max_img_num:
+            idx = self.image_indices.popleft()
+            self.messages[idx] = {
+                'role': self.messages[idx]['role'],
+                'content': self.messages[idx]['content'][0]['text'] + "\n\n### Image\n(Omitted)",
+            }
+
+    def extend(self, msgs):
+        for msg in msgs:
+            self.append(msg)
+
+    def __len__(self):
+        return len(self.messages)
+
+
+def clip_message_and_obs(msg, max_img_num):
+    return ConversationBuffer(max_img_num, msg).messages
+
+
+def load_task_page(driver_task, task_dir, url):
+    success = driver_get_safe(driver_task, url)
+    assert success
+    try:  # just quickly abort the alert
+        alert = driver_task.switch_to.alert
+        alert.accept()
+    except NoAlertPresentException:
+        pass
+
+    driver_task.refresh()
+    try:  # just quickly abort the alert
+        alert = driver_task.switch_to.alert
+        alert.accept()
+    except NoAlertPresentException:
+        pass
+    alert_obs = save_transition_video(driver_task, task_dir, 1)
+    try:  # <- make sure downloads land in `task_dir/download`, also in headless mode
+        driver_task.execute_cdp_cmd('Browser.setDownloadBehavior', {
+            'behavior': 'allow', 'downloadPath': os.path.abspath(os.path.join(task_dir, 'download')),
+        })
+    except Exception as e:
+        logging.error(f"Error while setting download behavior: {e}")
+
+    try:
+        driver_task.find_element(By.TAG_NAME, 'body').click()
+        time.sleep(1)
+        driver_execute_script_safe(driver_task, "return 1;")  # no-op, flushing some errors...
+        time.sleep(1)
+    except Exception as e:
+        logging.error(f"Error while clicking body: {e}")
+        pass
+    # sometimes enter SPACE, the page will sroll down
+    driver_execute_script_safe(
+        driver_task,
+        """window.onkeydown = function(e) {if(e.keyCode == 32 && e.target.type != 'text' && e.target.type != 'textarea') {e.preventDefault();}};"""
+    )
+    time.sleep(5)
+    return alert_obs
+
+
+@traced('driver.setup')
+def setup_task_driver(task_dir, url, window_width, window_height):
+    driver_task = get_default_driver(tmp_path=task_dir)
+
+    try:
+        # About window size, 765 tokens
+        # You can resize to height = 512 by yourself (255 tokens, Maybe bad performance)
+        driver_task.set_window_size(window_width, window_height)  # larger height may contain more web information
+        alert_obs = load_task_page(driver_task, task_dir, url)
+    except:
+        driver_task.quit()
+        raise
+
+    return driver_task, alert_obs
+
+
+# storage of the current page's origin: localStorage, sessionStorage (per tab) and IndexedDB. Used for file:// pages,
+# whose origin can't be cleared with Storage.clearDataForOrigin
+CLEAR_STORAGE_SCRIPT = """
+const done = arguments[arguments.length - 1];
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+if (!window.indexedDB || !window.indexedDB.databases) { done(); return; }
+window.indexedDB.databases().then(dbs => Promise.all(dbs.map(db => new Promise(resolve => {
+    const req = window.indexedDB.deleteDatabase(db.name);
+    req.onsuccess = req.onerror = req.onblocked = () => resolve();
+})))).then(() => done(), () => done());
+"""
+
+
+@traced('driver.reset')
+def reset_task_driver(driver_task, task_dir, url):
+    """Bring a browser used by a previous agent back to the state of a freshly opened one, then load `url` again.
+
+    A fresh browser has a single tab and empty cookies / storage, so resetting to that is restoring the initial state.
+    """
+    handles = driver_task.window_handles
+    for handle in handles[1:]:
+        driver_task.switch_to.window(handle)
+        driver_task.close()
+    driver_task.switch_to.window(handles[0])
+    try:
+        driver_task.switch_to.alert.accept()
+    except NoAlertPresentException:
+        pass
+    # the agent may have left the website: clear storage from a page of its origin
+    driver_get_safe(driver_task, url)
+    driver_task.execute_async_script(CLEAR_STORAGE_SCRIPT)
+    driver_get_safe(driver_task, 'about:blank')
+    driver_task.execute_cdp_cmd('Network.clearBrowserCookies', {})
+    origin = urlparse(url)
+    if origin.scheme in ('http', 'https'):  # <- also caches, service workers, etc.
+        driver_task.execute_cdp_cmd('Storage.clearDataForOrigin', {
+            'origin': '{}://{}'.format(origin.scheme, origin.netloc), 'storageTypes': 'all',
+        })
+    return load_task_page(driver_task, task_dir, url)
+
+
+def setup_task_driver_with_retry(task_dir, url, window_width, window_height, patience=5, wait_if_fail=30):
+    while True:
+        try:
+            return setup_task_driver(task_dir, url, window_width, window_height)
+        except Exception as e:
+            patience -= 1
+            time.sleep(wait_if_fail)
+            if patience == 0:
+                raise RuntimeError("Error keeps happening when opening {}: {}".format(url, e))
+
+
+def exec_action_upload(info, web_ele, driver_task):
+    filenames = []
+    non_exist = []
+    valid_files = ['placeholder.png', 'placeholder.mp3', 'placeholder.mp4', 'placeholder.pdf']
+    for fn in info['content']:
+        if fn in valid_files:
+            fn = os.path.abspath(os.path.join(os.path.dirname(__file__), '../placeholder', fn))
+            assert os.path.exists(fn)
+            filenames.append(fn)
+        else:
+            non_exist.append(fn)
+    if non_exist:
+        return "Files {} don't exist. Please choose between {}. Nothing is uploaded".format(
+            ', '.join(non_exist), ', '.join(valid_files)
+        )
+    web_ele.send_keys("\n".join(filenames))
+    return ''
+
+
+def crop_screenshot_for_rect(filename, rect):
+    screenshot = Image.open(filename)
+    img_w, img_h = screenshot.size
+    # Original rectangle values
+    x, y, w, h = int(rect['x']), int(rect['y']), int(rect['width']), int(rect['height'])
+    # Double size, keep original in the center
+    new_w, new_h = 2 * w, 2 * h
+    new_x = x - (new_w - w) // 2
+    new_y = y - (new_h - h) // 2
+    # Clamp coordinates within image bounds
+    left = max(0, new_x)
+    top = max(0, new_y)
+    right = min(img_w, new_x + new_w)
+    bottom = min(img_h, new_y + new_h)
+    return screenshot.crop((left, top, right, bottom))
+
+
+def merge_images(images, nrow=1, ncol=None, pad_percentage=5, bg_color=(255, 255, 255)):
+    # Ensure all images are RGB
+    images = [img.convert("RGB") for img in images]
+    if ncol is None:
+        assert len(images) % nrow == 0
+        ncol = len(images) // nrow
+    else:
+        assert len(images) == nrow * ncol
+
+    # Compute max width and height per cell
+    cell_width = max(img.width for img in images)
+    cell_height = max(img.height for img in images)
+    pad = max(cell_width, cell_height) * pad_percentage // 100
+
+    # Compute new image size
+    total_width = ncol * cell_width + (ncol - 1) * pad
+    total_height = nrow * cell_height + (nrow - 1) * pad
+    new_img = Image.new("RGB", (total_width, total_height), bg_color)
+
+    # Paste images into the grid
+    for idx, img in enumerate(images):
+        row, col = divmod(idx, ncol)
+        x = col * (cell_width + pad)
+        y = row * (cell_height + pad)
+        # Center image within its cell
+        x_offset = x + (cell_width - img.width) // 2
+        y_offset = y + (cell_height - img.height) // 2
+        new_img.paste(img, (x_offset, y_offset))
+
+    return new_img
+
+
+def save_transition_video(driver, task_dir, it, n_frames=9, interval=0.4):
+    alert_obs = ''
+    try:  # check alert observation BEFORE saving transition
+        alert = driver.switch_to.alert
+        alert_obs = alert.text  # optional, to log
+        alert.accept()  # or alert.dismiss()
+    except NoAlertPresentException:
+        pass  # no alert, safe to continue
+
+    save_prefix = os.path.join(task_dir, f'screenshot_animation-{it}')
+    for i in range(n_frames):
+        time.sleep(interval)
+        driver.save_screenshot(save_prefix + "_{}.png".format(i + 1))
+
+    return alert_obs
+
+
+def cleanup_transition_video(task_dir):
+    for file_path in glob.glob(os.path.join(task_dir, 'screenshot_animation-*_*.png')):
+        try:
+            os.remove(file_path)
+        except Exception as e:
+            pass
+
+
+def thumbnail_by_max_pixels(img, max_pixels):
+    w, h = img.size
+    current_pixels = w * h
+    if current_pixels <= max_pixels:
+        return img  # no resizing needed
+
+    scale = (max_pixels / current_pixels) ** 0.5
+    new_size = (int(w * scale), int(h * scale))
+
+    img_copy = img.copy()
+    img_copy.thumbnail(new_size, Image.LANCZOS)
+    return img_copy
+
+
+def exec_browser_action(action_key, info, web_eles, driver_task, window_height, text_only=False):
+    warn_obs = ""
+    if action_key == 'click':
+        click_ele_number = int(info[0])
+        web_ele = web_eles[click_ele_number]
+        exec_action_click(info, web_ele, driver_task)
+
+    elif action_key == 'hover':
+        click_ele_number = int(info[0])
+        web_ele = web_eles[click_ele_number]
+        ActionChains(driver_task).move_to_element(web_ele).perform()
+
+    elif action_key == 'type':
+        type_ele_number = int(info['number'])
+        web_ele = web_eles[type_ele_number]
+        warn_obs = exec_action_type(info, web_ele, driver_task)
+
+    elif action_key == 'scroll':
+        exec_action_scroll(info, web_eles, driver_task, None, window_height, text_only=text_only)
+
+    elif action_key == 'goback':
+        driver_task.back()
+
+    elif action_key == 'upload':
+        type_ele_number = int(info['number'])
+        web_ele = web_eles[type_ele_number]
+        warn_obs2 = exec_action_upload(info, web_ele, driver_task)
+        if warn_obs2:
+            warn_obs = warn_obs + '\n' + warn_obs2
+
+    elif action_key == 'select':
+        type_ele_number = int(info['number'])
+        web_ele = web_eles[type_ele_number]
+        warn_obs = exec_action_select(info, web_ele, driver_task)
+
+    else:
+        raise NotImplementedError("{} isn't implemented".format(action_key))
+
+    return warn_obs
+
+
+def exec_visual_action(action_key, info, task_dir, it, rects_cache, image_width, image_height):
+    # visual inspection events, not going to interact with the browser. Returns (visuals, fail_obs)
+    if action_key == 'viewraw':
+        i = int(info['content'].split('_')[-1])
+        return {'': {
+            'name': f'Raw screenshot_{i}',
+            'url': image_ref(os.path.join(task_dir, 'screenshot{}_raw.png'.format(i)))
+        }}, ""
+
+    elif action_key == 'compare':
+        ele_num = int(info['number'])
+        i, j = int(info['content'][0]), int(info['content'][1])
+        if i == j:
+            return None, ('You need to compare two **different** screenshots; '
+                          'instead you compared screenshot_{} and screenshot_{}').format(i, j)
+        img_i = crop_screenshot_for_rect(os.path.join(task_dir, f"screenshot{i}_raw.png"), rects_cache[i][ele_num])
+        img_j = crop_screenshot_for_rect(os.path.join(task_dir, f"screenshot{j}_raw.png"), rects_cache[j][ele_num])
+        img = merge_images([img_i, img_j])
+        img.save(os.path.join(task_dir, "screenshot{}.png".format(it + 1)))
+        return {'': {
+            'name': 'Component [{}] from screenshot {} and {}'.format(ele_num, j, i),
+            'url': image_ref(os.path.join(task_dir, "screenshot{}.png".format(it + 1)))
+        }}, ""
+
+    else:
+        assert action_key == 'viewanimation'
+        i_window = int(info['content'].split('_')[-1])
+        image_files = [os.path.join(task_dir, f'screenshot_animation-{i_window}_{i + 1}.png') for i in range(9)]
+        if info['number'] == 'WINDOW':
+            images = [Image.open(fn) for fn in image_files]
+            name = "Animation when loading screenshot {}".format(i_window)
+        else:
+            ele_num = int(info['number'])
+            images = [crop_screenshot_for_rect(fn, rects_cache[i_window][ele_num]) for fn in image_files]
+            name = "Animation for element [{}] when loading screenshot {}".format(ele_num, i_window)
+        image_merged = merge_images(images, nrow=3, ncol=3)
+        image_merged = thumbnail_by_max_pixels(image_merged, image_width * image_height)
+        image_merged.save(os.path.join(task_dir, "screenshot{}.png".format(it + 1)))
+        return {'': {'name': name, 'url': image_ref(os.path.join(task_dir, "screenshot{}.png".format(it + 1)))}}, ""
+
+
+VISUAL_ACTIONS = ('viewraw', 'compare', 'viewanimation')
+ACCESSIBILITY_TREE_MODES = ('off', 'sync', 'background')  # <- none of the prompts uses the tree: only for archival
+
+
+class AgentPolicy:
+    """Prompting and termination policy of an agent driven by `run_agent`.
+
+    The default implementation keeps going until `max_iter`, appending `last_msg` to the observation at the last step.
+    """
+    system_prompt = None
+    last_msg = None
+    screenshot_name = True  # <- mention "screenshot_{it}" in observations
+    visual_inspection = True  # <- support ViewRaw / Compare / ViewAnimation
+    finalize_on_observation_error = True  # <- if set-of-mark fails, ask for a final answer instead of just stopping
+
+    def __init__(self, init_msg, max_iter=15):
+        self.init_msg = init_msg
+        self.max_iter = max_iter
+
+    def initial_messages(self):
+        return [{'role': 'system', 'content': self.system_prompt}]
+
+    def observation_messages(self, it, pdf_obs, alert_obs, warn_obs, img_url, web_eles_text):
+        # returns (messages, whether this is the last step)
+        return format_msg(it, self.init_msg, pdf_obs, alert_obs, warn_obs, img_url, web_eles_text,
+                          self.last_msg if it == self.max_iter else None, screenshot_name=self.screenshot_name), False
+
+    def fail_message(self, it, fail_obs):
+        curr_msg = {'role': 'user', 'content': fail_obs}
+        if it >= self.max_iter:
+            curr_msg['content'] = fail_obs.strip() + '\n\n' + self.last_msg
+        return curr_msg, False
+
+    def stop_after_response(self, it):
+        return False
+
+    def handle_answer(self, action_key, info, response):
+        # None: not an answer (or not supported); 'stop': stop right away; 'final': request `last_msg` once more, then stop
+        return None
+
+    def result(self, messages, response):
+        return None
+
+
+class AgentHooks:
+    """Hook surface of `run_agent`; subclass and override what's needed."""
+
+    def on_step_end(self, it, timings):
+        # per-step wall-clock seconds by phase: 'observe', 'llm', 'act'
+        pass
+
+    def on_screenshot(self, it, path, kind):
+        # kind: 'raw' (before set-of-mark) or 'annotated' (sent to the LLM)
+        pass
+
+    def execute_action(self, action_key, info, web_eles, driver_task, window_height, text_only=False):
+        return exec_browser_action(action_key, info, web_eles, driver_task, window_height, text_only=text_only)
+
+    def on_session_end(self, driver_task):
+        # after the last step, while the browser is still open
+        pass
+
+
+def run_agent(
+        driver_task, alert_obs, task_dir, policy: AgentPolicy, request_fn, hooks: AgentHooks = None,
+        window_width=2048, window_height=1536, image_width=1024, image_height=768, max_attached_imgs=6,
+        text_only=False, accessibility_tree='off',
+):
+    """Run the observe -> LLM -> act loop on an opened `driver_task` until `policy` says to stop.
+
+    `request_fn(messages)` returns the LLM response. Returns `policy.result(messages, last_response)`.
+    `accessibility_tree` controls whether `accessibility_tree{it}.json/.txt` are saved: 'off', 'sync', or 'background'
+    (fetched while waiting for the LLM, before the next browser action).
+    """
+    assert accessibility_tree in ACCESSIBILITY_TREE_MODES
+    if hooks is None:
+        hooks = AgentHooks()
+    ax_executor = ThreadPoolExecutor(max_workers=1) if accessibility_tree == 'background' else None
+    ax_future = None
+
+    # We only deal with PDF file
+    download_dir = os.path.join(task_dir, "download")
+    shutil.rmtree(download_dir, ignore_errors=True)
+    os.makedirs(download_dir, exist_ok=True)
+    downloads = DownloadWatcher(download_dir)
+
+    fail_obs = ""  # When error execute the action
+    downloaded = []  # When download PDF file
+    warn_obs = ""  # Type warning
+
+    messages = ConversationBuffer(max_attached_imgs, policy.initial_messages())  # <- clipped as messages come in
+
+    it = 0
+    response = ''
+    visuals = None
+    last_step = False
+    rects = []
+    web_eles = []
+    rects_cache = {}
+    while it <= policy.max_iter:
+        logging.info(f'Iter: {it}')
+        it += 1
+        timings = {}
+        t0 = time.time()
+
+        if last_step:
+            messages.append({'role': 'user', 'content': policy.last_msg})
+
+        elif visuals is not None:  # <- visual inspection, only append images in the message
+            messages.extend(format_visual_msg(visuals))
+            visuals = None
+
+        elif not fail_obs:
+            img_path_raw = os.path.join(task_dir, 'screenshot{}_raw.png'.format(it))
+            with span('observe.screenshot', it=it, kind='raw'):
+                driver_task.save_screenshot(img_path_raw)
+            hooks.on_screenshot(it, img_path_raw, 'raw')
+
+            try:
+                rects, web_eles, web_eles_text = get_web_element_rect(driver_task, fix_color=False)
+                if policy.visual_inspection:
+                    rects_cache[it] = [rect.rect for rect in rects]
+            except Exception as e:
+                logging.error('Driver error when adding set-of-mark.')
+                logging.error(e)
+                if not policy.finalize_on_observation_error:
+                    break
+                last_step = True
+                messages.append({'role': 'user', 'content': policy.last_msg})
+
+            if not last_step:
+                img_path = os.path.join(task_dir, 'screenshot{}.png'.format(it))
+                with span('observe.screenshot', it=it, kind='annotated'):
+                    driver_task.save_screenshot(img_path)
+                if image_width != window_width or image_height != window_height:
+                    with span('observe.resize', it=it):
+                        Image.open(img_path).resize((image_width, image_height)).save(img_path)
+                    # <- only resize down annotated screenshot
+                hooks.on_screenshot(it, img_path, 'annotated')
+
+                # accessibility tree
+                accessibility_tree_path = os.path.join(task_dir, 'accessibility_tree{}'.format(it))
+                if accessibility_tree == 'sync':
+                    get_webarena_accessibility_tree(driver_task, accessibility_tree_path)
+                elif accessibility_tree == 'background':
+                    ax_future = ax_executor.submit(bind_tracer(get_webarena_accessibility_tree), driver_task,
+                                                   accessibility_tree_path)
+
+                # reference to the image, only encoded when sending the request
+                img_url = image_ref(img_path)
+
+                # format msg
+                pdf_obs = downloads.observation(downloaded)
+                curr_msg, last_step = policy.observation_messages(it, pdf_obs, alert_obs, warn_obs, img_url,
+                                                                  web_eles_text)
+                messages.extend(curr_msg)
+
+        else:
+            curr_msg, last_step = policy.fail_message(it, fail_obs)
+            messages.append(curr_msg)
+
+        timings['observe'] = time.time() - t0
+
+        # Call LLM API
+        t0 = time.time()
+        with span('llm', it=it):
+            response = request_fn(messages.messages)
+        messages.append({'role': 'assistant', 'content': response})
+        timings['llm'] = time.time() - t0
+        if ax_future is not None:  # <- the page must not change (or close) before the tree is fetched
+            with span('observe.accessibility_tree_wait', it=it):
+                try:
+                    ax_future.result()
+                except Exception as e:
+                    logging.error('Error when fetching accessibility tree in background.')
+                    logging.error(e)
+            ax_future = None
+        if last_step or policy.stop_after_response(it):
+            hooks.on_step_end(it, timings)
+            break
+
+        t0 = time.time()
+        # remove the rects on the website
+        if rects:
+            logging.info(f"Num of interactive elements: {len(rects)}")
+            with span('act.remove_rects', it=it):
+                for rect_ele in rects:
+                    driver_execute_script_safe(driver_task, "arguments[0].remove()", rect_ele)
+            rects = []
+
+        # extract action info
+        try:
+            assert 'Thought:' in response and 'Action:' in response
+        except AssertionError as e:
+            logging.error(e)
+            fail_obs = FORMAT_ERROR_MSG
+            hooks.on_step_end(it, timings)
+            continue
+
+        chosen_action = re.split(ACTION_PATTERN, response)[2].strip()
+        action_key, info = extract_information(chosen_action)
+
+        fail_obs = ""
+        downloaded = []
+        warn_obs = ""
+        stop = False
+        # execute action
+        try:
+            answer = policy.handle_answer(action_key, info, response)
+            if answer == 'stop':
+                stop = True
+            elif answer == 'final':
+                last_step = True
+
+            elif policy.visual_inspection and action_key in VISUAL_ACTIONS:
+                with span('act.visual', it=it, action=action_key):
+                    visuals, fail_obs = exec_visual_action(action_key, info, task_dir, it, rects_cache,
+                                                           image_width, image_height)
+
+            else:  # Below: all browser actions
+                window_handle_task = driver_task.current_window_handle
+                driver_task.switch_to.window(window_handle_task)
+
+                with span('act.action', it=it, action=action_key):
+                    warn_obs = hooks.execute_action(action_key, info, web_eles, driver_task, window_height,
+                                                    text_only=text_only)
+
+                with span('act.transition', it=it):
+                    alert_obs = save_transition_video(driver_task, task_dir, it + 1)
+
+                # deal with download file: waits only if a download started, PDF text is extracted in background
+                downloaded = downloads.check()
+
+        except Exception as e:
+            logging.error('driver error info:')
+            logging.error(e)
+            if 'element click intercepted' not in str(e):
+                fail_obs = ACTION_ERROR_MSG
+            else:
+                fail_obs = ""
+            time.sleep(2)
+
+        timings['act'] = time.time() - t0
+        hooks.on_step_end(it, timings)
+        if stop:
+            break
+
+    hooks.on_session_end(driver_task)
+    if ax_executor is not None:
+        ax_executor.shutdown()
+    downloads.close()
+    print_message(messages.messages, task_dir)
+    return policy.result(messages.messages, response)
@@ -0,0 +1,89 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import span, bind_tracer
+from .utils import extract_text_from_pdf
+
+PARTIAL_SUFFIXES = ('.crdownload', '.tmp', '.part')
+
+
+class DownloadWatcher:
+    """Track files downloaded by the browser into `download_dir`.
+
+    `check()` returns as soon as newly started downloads are complete (no partial file left and sizes stable), instead
+    of always sleeping a fixed time. Text of downloaded PDFs is extracted in a background thread and only waited for when
+    the observation is formatted.
+    """
+
+    def __init__(self, download_dir, timeout=10, interval=0.2):
+        self.download_dir = download_dir
+        self.timeout = timeout
+        self.interval = interval
+        self.seen = set()
+        self.stale = set()  # <- partial files that were still incomplete at the end of a wait
+        self.pdf_text = {}  # <- filename -> future of extracted text
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def _list(self):
+        # filename -> size, without partial files of downloads that already timed out
+        try:
+            return {fn: os.path.getsize(os.path.join(self.download_dir, fn)) for fn in os.listdir(self.download_dir)
+                    if fn not in self.stale}
+        except FileNotFoundError:  # <- file renamed from partial to final name between listdir and getsize
+            return None
+
+    def check(self):
+        files = self._list()
+        if files is None or set(files) == self.seen:
+            return []
+
+        # something new started: wait until all partial files are gone and sizes are stable across two polls
+        with span('act.download_wait'):
+            deadline = time.time() + self.timeout
+            last = None
+            while time.time() < deadline:
+                if files is not None and not any(fn.endswith(PARTIAL_SUFFIXES) for fn in files) and files == last:
+                    break
+                last = files
+                time.sleep(self.interval)
+                files = self._list()
+            else:
+                # stalled or abandoned downloads: don't wait for them again at every step. If one completes later,
+                # its final name is still reported as a new file
+                stale = {fn for fn in (files or last or {}) if fn.endswith(PARTIAL_SUFFIXES)}
+                if len(stale) > 0:
+                    logging.warning('Downloads still incomplete after {}s: {}'.format(self.timeout, sorted(stale)))
+                    self.stale.update(stale)
+            if files is None:
+                files = self._list() or {}
+
+        new_files = sorted(fn for fn in files if fn not in self.seen and fn not in self.stale
+                           and not fn.endswith(PARTIAL_SUFFIXES))
+        self.seen.update(new_files)  # <- partial files are reported once they complete
+        for fn in new_files:
+            if fn.endswith('.pdf'):
+                self.pdf_text[fn] = self.executor.submit(
+                    bind_tracer(extract_text_from_pdf), os.path.join(self.download_dir, fn)
+                )
+        return new_files
+
+    def observation(self, new_files):
+        if len(new_files) == 0:
+            return ""
+        obs = "You have downloaded the following files: " + ", ".join(new_files)
+        for fn in new_files:
+            if fn in self.pdf_text:
+                with span('observe.pdf_extract_wait'):
+                    try:
+                        text = self.pdf_text[fn].result()
+                    except Exception as e:
+                        logging.error('Error when extracting text from {}'.format(fn))
+                        logging.error(e)
+                        text = ""
+                obs += "\n\n# Content of {}\n{}\n\n".format(fn, text)
+        return obs.strip()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,40 @@
+import importlib
+import sys
+import threading
+import types
+
+# Deferred imports of heavy dependencies (provider SDKs, matplotlib, pdfplumber) that only some code paths use, so that
+# entry points and their pool workers don't pay for them at startup. `python benchmark_import_time.py` measures it.
+# importlib.util.LazyLoader is not used: before Python 3.12 it is not thread-safe, and the SDKs are first used from
+# the threads of the verification / comparison pools.
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for module `name`, imported on first attribute access."""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._lock = threading.Lock()
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self.__name__)
+        return self._module
+
+    def __getattr__(self, attr):  # <- only called for attributes not set in __init__
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        return "<lazy module '{}'{}>".format(self.__name__, '' if self._module is None else ' (loaded)')
+
+
+def lazy_import(name):
+    # the real module if it is already imported, otherwise a `LazyModule`; unlike LazyLoader, sys.modules is left
+    # untouched, so a regular `import name` elsewhere still gets the real module
+    return sys.modules[name] if name in sys.modules else LazyModule(name)
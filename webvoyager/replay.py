@@ -0,0 +1,95 @@
+import json
+import os
+import time
+
+from .agent import AgentHooks, run_agent, setup_logger, setup_task_driver_with_retry, cleanup_transition_video
+from .tracing import trace_session, span
+
+# Record / replay of agent sessions: the LLM responses recorded in `interact_messages.json` of a real run are served
+# again in order, so the same action sequence is executed against the same website without any model call. Used to
+# benchmark (and check for regressions in) everything on the browser side of the agent loop.
+
+
+class ReplayExhausted(Exception):
+    pass
+
+
+def observation_text(msg):
+    # text of a user message, without the image (which may or may not have been clipped when recorded)
+    content = msg['content']
+    if not isinstance(content, str):
+        content = content[0]['text']
+    return content.split("\n\n### Image\n(Omitted)")[0].strip()
+
+
+class ReplayLLM:
+    """`request_fn` for `run_agent` that returns the recorded responses in order.
+
+    Each observation is compared with the recorded one at the same position; differences (e.g. different set-of-mark
+    labels) mean the replayed session may have diverged from the recorded one, and are kept in `mismatches`.
+    """
+
+    def __init__(self, recorded_messages):
+        self.recorded = recorded_messages
+        self.responses = [m['content'] for m in recorded_messages if m['role'] == 'assistant']
+        self.n_calls = 0
+        self.mismatches = []
+
+    def __call__(self, messages):
+        if self.n_calls >= len(self.responses):
+            raise ReplayExhausted("Replay asked for more than {:d} recorded responses".format(len(self.responses)))
+        pos = len(messages) - 1
+        if pos >= len(self.recorded) or self.recorded[pos]['role'] != 'user' or \
+                observation_text(self.recorded[pos]) != observation_text(messages[-1]):
+            self.mismatches.append(self.n_calls)
+        response = self.responses[self.n_calls]
+        self.n_calls += 1
+        return response
+
+
+class TimingHooks(AgentHooks):
+    def __init__(self):
+        self.timings = []
+
+    def on_step_end(self, it, timings):
+        self.timings.append(timings)
+
+
+def load_recorded_messages(recorded_task_dir):
+    with open(os.path.join(recorded_task_dir, 'interact_messages.json')) as f:
+        return json.load(f)
+
+
+def replay_session(url, recorded_task_dir, policy, task_dir, window_width=2048, window_height=1536,
+                   image_width=1024, image_height=768, max_attached_imgs=6):
+    """Replay the session recorded in `recorded_task_dir` on `url` with `policy`, writing outputs to `task_dir`.
+
+    Returns a dict with the number of replayed / recorded responses, the steps whose observation differs from the
+    recorded one, per-step timings and the wall-clock time of the session (driver setup included).
+    """
+    llm = ReplayLLM(load_recorded_messages(recorded_task_dir))
+    hooks = TimingHooks()
+
+    os.makedirs(task_dir, exist_ok=True)
+    setup_logger(task_dir)
+
+    t0 = time.time()
+    error = None
+    with trace_session(task_dir):
+        driver_task, alert_obs = setup_task_driver_with_retry(task_dir, url, window_width, window_height,
+                                                              patience=1, wait_if_fail=0)
+        try:
+            run_agent(driver_task, alert_obs, task_dir, policy, llm, hooks=hooks, window_width=window_width,
+                      window_height=window_height, image_width=image_width, image_height=image_height,
+                      max_attached_imgs=max_attached_imgs)
+        except ReplayExhausted as e:
+            error = str(e)
+        finally:
+            with span('driver.quit'):
+                driver_task.quit()
+    cleanup_transition_video(task_dir)
+
+    return {
+        'n_replayed': llm.n_calls, 'n_recorded': len(llm.responses), 'mismatches': llm.mismatches,
+        'timings': hooks.timings, 'total': time.time() - t0, 'error': error,
+    }
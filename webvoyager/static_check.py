@@ -0,0 +1,185 @@
+import html
+import os
+import re
+from html.parser import HTMLParser
+from urllib.parse import urlparse, unquote
+
+# Tier-1 evaluation: decide obvious test conditions from the website source alone, before paying for an agent session.
+# Verdicts are 'PASS' / 'FAIL' when confident, or None to escalate to the full agent (`run_evaluate`).
+
+SOURCE_EXTENSIONS = ('.html', '.htm', '.js', '.css', '.json')
+QUOTED_PATTERN = r'["“]([^"”]{2,80})["”]'
+NAVIGATION_PATTERNS = [  # <- conditions that ONLY ask whether a page is reachable from the homepage
+    r'^(?:verify|ensure|check)(?: that)? (?:the )?["“](?P<page>[^"”]+)["”] page is (?:accessible|reachable) '
+    r'from the homepage\.?$',
+    r'^(?:users can )?navigate (?:from the homepage )?to the ["“](?P<page>[^"”]+)["”] page(?: from the homepage)?\.?$',
+    r'^from the homepage, users can (?:access|navigate to) the ["“]?(?P<page>[^"”]+?)["”]? page\.?$',
+]
+# verbs after which a quoted string is likely text the user types (e.g. `enter a keyword such as "landscape"`), not
+# the name of something on the website
+TYPED_TEXT_PATTERN = r'\b(?:enter(?:s|ed|ing)?|typ(?:e|es|ed|ing)(?! of)|input(?:s|ted|ting)?|quer(?:y|ies)|' \
+                     r'keywords?|fill(?:s|ed|ing)? (?:in|out)|writ(?:e|es|ing)|search(?:es|ed|ing)?' \
+                     r'(?! (?:bar|results|functionality|feature|section|tool|icon|state|criteria|option)))\b'
+JS_LINK_PATTERN = r'''["'`]([\w\-./%]+\.html?)(?:[#?][^"'`]*)?["'`]'''
+
+
+class PageParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.texts = []
+        self.links = []  # <- (href, anchor text)
+        self.scripts = []  # <- src of external scripts
+        self._skip = 0
+        self._anchor = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag in ('script', 'style'):
+            self._skip += 1
+            if tag == 'script' and attrs.get('src'):
+                self.scripts.append(attrs['src'])
+        for key in ('alt', 'title', 'aria-label', 'placeholder', 'value'):
+            if attrs.get(key):
+                self.texts.append(attrs[key])
+        if tag in ('a', 'area') and attrs.get('href'):
+            self._anchor = [attrs['href'], []]
+            self.links.append(self._anchor)
+        elif tag == 'form' and attrs.get('action'):
+            self.links.append([attrs['action'], []])
+        for key in ('onclick', 'data-href', 'data-url'):
+            for href in re.findall(JS_LINK_PATTERN, attrs.get(key) or ''):
+                self.links.append([href, [attrs.get('aria-label') or '']])
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style'):
+            self._skip = max(0, self._skip - 1)
+        if tag in ('a', 'area'):
+            self._anchor = None
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        self.texts.append(data)
+        if self._anchor is not None:
+            self._anchor[1].append(data)
+
+
+def normalize_text(text):
+    # lower-case, tokenize and crudely singularize, so that e.g. "Testimonials" matches "testimonial"
+    words = re.findall(r'[a-z0-9]+', html.unescape(text).lower())
+    words = [w[:-1] if len(w) > 3 and w.endswith('s') and not w.endswith('ss') else w for w in words]
+    return ' ' + ' '.join(words) + ' '
+
+
+def contains(haystack, phrase):
+    phrase = normalize_text(phrase)
+    return phrase.strip() != '' and phrase in haystack
+
+
+def local_target(site_dir, page_path, href):
+    url = urlparse(href)
+    if url.scheme not in ('', 'file') or not url.path:
+        return None
+    path = unquote(url.path)
+    if url.scheme == 'file':
+        path = os.path.normpath(path)
+    else:
+        path = os.path.normpath(os.path.join(os.path.dirname(page_path), path))
+    if os.path.isdir(path):
+        path = os.path.join(path, 'index.html')
+    if not path.startswith(os.path.abspath(site_dir)) or not os.path.exists(path):
+        return None
+    return path
+
+
+def parse_site(site_dir):
+    site_dir = os.path.abspath(site_dir)
+    pages = {}
+    raw = []
+    for dirpath, dirnames, filenames in os.walk(site_dir):
+        dirnames[:] = [dn for dn in dirnames if not dn.endswith('tmpdir')]
+        for fn in filenames:
+            path = os.path.join(dirpath, fn)
+            if not fn.lower().endswith(SOURCE_EXTENSIONS):
+                continue
+            with open(path, errors='ignore') as f:
+                content = f.read()
+            raw.append(content)
+            if fn.lower().endswith(('.html', '.htm')):
+                parser = PageParser()
+                try:
+                    parser.feed(content)
+                except Exception:
+                    pass
+                links = [(href, ' '.join(text)) for href, text in parser.links]
+                links += [(href, '') for href in re.findall(JS_LINK_PATTERN, content)]
+                for src in parser.scripts:  # <- links built by external scripts
+                    src = local_target(site_dir, path, src)
+                    if src is not None:
+                        with open(src, errors='ignore') as f:
+                            links += [(href, '') for href in re.findall(JS_LINK_PATTERN, f.read())]
+                pages[path] = {'text': normalize_text(' '.join(parser.texts)), 'links': links}
+    # everything that could possibly be rendered: visible text, and raw source (for content built in JS)
+    haystack = normalize_text(' '.join([p['text'] for p in pages.values()] + raw))
+    return pages, haystack
+
+
+def reachable_pages(site_dir, pages, start):
+    site_dir = os.path.abspath(site_dir)
+    seen = {start}
+    queue = [start]
+    while queue:
+        page = queue.pop(0)
+        for href, _ in pages.get(page, {}).get('links', []):
+            target = local_target(site_dir, page, href)
+            if target is not None and target in pages and target not in seen:
+                seen.add(target)
+                queue.append(target)
+    return seen
+
+
+def precheck_rule(reason):
+    # which rule of `static_precheck` gave a verdict, from its reason
+    if reason.startswith('index.html'):
+        return 'no index.html'
+    if reason.startswith('none of'):
+        return 'quoted names'
+    if reason.startswith('homepage links'):
+        return 'navigation'
+    return None
+
+
+def static_precheck(site_dir, test_conditions):
+    """Tier-1 verdict for one test condition: returns (verdict, reason), where verdict is 'PASS', 'FAIL' or None."""
+    index = os.path.abspath(os.path.join(site_dir, 'index.html'))
+    if not os.path.exists(index):
+        return 'FAIL', 'index.html does not exist'
+
+    pages, haystack = parse_site(site_dir)
+
+    # 1. nothing that the condition refers to by name exists anywhere in the source -> it can't be rendered. Not applied
+    # when a quoted string may be typed by the user, since it then doesn't have to be in the source
+    condition = test_conditions['condition']
+    matches = list(re.finditer(QUOTED_PATTERN, condition))
+    typed = any(re.search(TYPED_TEXT_PATTERN, condition[:m.start()], re.I) for m in matches)
+    quoted = [m.group(1).strip() for m in matches]
+    quoted = [q for q in quoted if re.search(r'[A-Za-z]', q)]
+    if len(quoted) > 0 and not typed and not any(contains(haystack, q) for q in quoted):
+        return 'FAIL', 'none of {} appears in the website source'.format(', '.join(f'"{q}"' for q in quoted))
+
+    # 2. purely navigational condition, and the homepage links to an existing page about it
+    for pattern in NAVIGATION_PATTERNS:
+        match = re.match(pattern, test_conditions['condition'].strip(), re.I)
+        if match is None:
+            continue
+        page_name = match.group('page')
+        reachable = reachable_pages(site_dir, pages, index)
+        for href, anchor_text in pages[index]['links']:
+            target = local_target(site_dir, index, href)
+            if target is None or target == index or target not in reachable:
+                continue
+            if contains(normalize_text(anchor_text), page_name) and contains(pages[target]['text'], page_name):
+                return 'PASS', 'homepage links to {} ("{}")'.format(os.path.relpath(target, site_dir), page_name)
+        break
+
+    return None, 'escalate to agent'
@@ -0,0 +1,87 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Lightweight span tracer for agent sessions. Spans are no-ops unless a trace is started in the current thread, so the
+# instrumented functions cost nothing when called outside of an agent session (e.g. from inference scripts).
+# Traces are written in Chrome trace-event format: open them in chrome://tracing or https://ui.perfetto.dev
+
+TRACE_FNAME = 'trace.json'
+
+_local = threading.local()
+
+
+class Tracer:
+    def __init__(self):
+        self.events = []
+        self.t0 = time.perf_counter()
+        self.pid = os.getpid()
+
+    def add(self, name, start, end, args=None):
+        self.events.append({
+            'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': self.pid, 'tid': threading.get_ident(),
+            'ts': round((start - self.t0) * 1e6, 1), 'dur': round((end - start) * 1e6, 1), 'args': args or {},
+        })
+
+    def dump(self, fname):
+        with open(fname, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def current_tracer():
+    return getattr(_local, 'tracer', None)
+
+
+@contextmanager
+def trace_session(task_dir):
+    """Record all spans of the current thread and write them to `task_dir/trace.json` on exit."""
+    tracer = _local.tracer = Tracer()
+    try:
+        with span('session', task_dir=task_dir):
+            yield tracer
+    finally:
+        _local.tracer = None
+        tracer.dump(os.path.join(task_dir, TRACE_FNAME))
+
+
+def bind_tracer(func):
+    # carry the current trace over to another thread (e.g. a background executor)
+    tracer = current_tracer()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        _local.tracer = tracer
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.tracer = None
+
+    return wrapper
+
+
+@contextmanager
+def span(name, **args):
+    tracer = current_tracer()
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(name, start, time.perf_counter(), args)
+
+
+def traced(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -6,9 +6,14 @@ import time
 from typing import Any, TypedDict
 
 import numpy as np
-import pdfplumber
 from PIL import Image
 
+from utils import image_ref
+from .lazy import lazy_import
+from .tracing import traced
+
+pdfplumber = lazy_import('pdfplumber')
+
 
 class AccessibilityTreeNode(TypedDict):
     nodeId: str
@@ -429,6 +434,7 @@ def resize_image(image_path):
 
 
 # interact with webpage and add rectangles on elements
+@traced('observe.set_of_mark')
 def get_web_element_rect(browser, fix_color=True):
     if fix_color:
         selected_function = "getFixedColor"
@@ -675,20 +681,20 @@ def clip_message(msg, max_img_num):
     for idx in range(len(msg)):
         curr_msg = msg[len(msg) - 1 - idx]
         if curr_msg['role'] != 'user':
-            clipped_msg = [curr_msg] + clipped_msg
+            clipped_msg.append(curr_msg)
         else:
             if type(curr_msg['content']) == str:
-                clipped_msg = [curr_msg] + clipped_msg
+                clipped_msg.append(curr_msg)
             elif img_num < max_img_num:
                 img_num += 1
-                clipped_msg = [curr_msg] + clipped_msg
+                clipped_msg.append(curr_msg)
             else:
                 curr_msg_clip = {
                     'role': curr_msg['role'],
                     'content': curr_msg['content'][0]["text"]
                 }
-                clipped_msg = [curr_msg_clip] + clipped_msg
-    return clipped_msg
+                clipped_msg.append(curr_msg_clip)
+    return clipped_msg[::-1]  # <- built from the newest message
 
 
 def clip_message_and_obs(msg, max_img_num):
@@ -697,13 +703,13 @@ def clip_message_and_obs(msg, max_img_num):
     for idx in range(len(msg)):
         curr_msg = msg[len(msg) - 1 - idx]
         if curr_msg['role'] != 'user':
-            clipped_msg = [curr_msg] + clipped_msg
+            clipped_msg.append(curr_msg)
         else:
             if type(curr_msg['content']) == str:
-                clipped_msg = [curr_msg] + clipped_msg
+                clipped_msg.append(curr_msg)
             elif img_num < max_img_num:
                 img_num += 1
-                clipped_msg = [curr_msg] + clipped_msg
+                clipped_msg.append(curr_msg)
             else:
                 msg_no_pdf = curr_msg['content'][0]["text"].split("Observation:")[
                                  0].strip() + "Observation: A screenshot and some texts. (Omitted in context.)"
@@ -714,8 +720,8 @@ def clip_message_and_obs(msg, max_img_num):
                     'content': msg_no_pdf if "You downloaded a PDF file" not in curr_msg['content'][0][
                         "text"] else msg_pdf
                 }
-                clipped_msg = [curr_msg_clip] + clipped_msg
-    return clipped_msg
+                clipped_msg.append(curr_msg_clip)
+    return clipped_msg[::-1]  # <- built from the newest message
 
 
 def clip_message_and_obs_text_only(msg, max_tree_num):
@@ -724,11 +730,11 @@ def clip_message_and_obs_text_only(msg, max_tree_num):
     for idx in range(len(msg)):
         curr_msg = msg[len(msg) - 1 - idx]
         if curr_msg['role'] != 'user':
-            clipped_msg = [curr_msg] + clipped_msg
+            clipped_msg.append(curr_msg)
         else:
             if tree_num < max_tree_num:
                 tree_num += 1
-                clipped_msg = [curr_msg] + clipped_msg
+                clipped_msg.append(curr_msg)
             else:
                 msg_no_pdf = curr_msg['content'].split("Observation:")[0].strip() + \
                              "Observation: An accessibility tree. (Omitted in context.)"
@@ -738,8 +744,8 @@ def clip_message_and_obs_text_only(msg, max_tree_num):
                     'role': curr_msg['role'],
                     'content': msg_no_pdf if "You downloaded a PDF file" not in curr_msg['content'] else msg_pdf
                 }
-                clipped_msg = [curr_msg_clip] + clipped_msg
-    return clipped_msg
+                clipped_msg.append(curr_msg_clip)
+    return clipped_msg[::-1]  # <- built from the newest message
 
 
 def print_message(json_object, save_dir=None):
@@ -757,18 +763,26 @@ def print_message(json_object, save_dir=None):
             else:
                 print_obj = {
                     'role': obj['role'],
-                    'content': obj['content']
+                    'content': [
+                        {**item, 'image_url': {"url": "data:image/png;base64,{b64_img}"}}
+                        if item['type'] == 'image_url' and not item['image_url']['url'].startswith('file:') else item
+                        for item in obj['content']
+                    ]  # <- image references are kept
                 }
-                for item in print_obj['content']:
-                    if item['type'] == 'image_url':
-                        item['image_url'] = {"url": "data:image/png;base64,{b64_img}"}
                 logging.info(print_obj)
+                if save_dir:  # <- saved relative to `save_dir`: see `utils.expand_image_refs(messages, save_dir)`
+                    print_obj['content'] = [
+                        {**item, 'image_url': {"url": image_ref(item['image_url']['url'][len('file://'):], save_dir)}}
+                        if item['type'] == 'image_url' and item['image_url']['url'].startswith('file://') else item
+                        for item in print_obj['content']
+                    ]
                 remove_b64code_obj.append(print_obj)
     if save_dir:
         with open(os.path.join(save_dir, 'interact_messages.json'), 'w', encoding='utf-8') as fw:
             json.dump(remove_b64code_obj, fw, indent=2)
 
 
+@traced('observe.accessibility_tree')
 def get_webarena_accessibility_tree(browser, save_file=None):
     browser_info = fetch_browser_info(browser)
     accessibility_tree = fetch_page_accessibility_tree(browser_info, browser, current_viewport_only=True)
@@ -797,6 +811,7 @@ def compare_images(img1_path, img2_path):
     return total_difference
 
 
+@traced('pdf_extract')
 def extract_text_from_pdf(file_path, max_length=120):
     text = ""
     with pdfplumber.open(file_path) as pdf: